@@ -0,0 +1,137 @@
+# Evaluates newline-delimited expressions without the GUI, fanning chunks of
+# lines out across a process pool.
+#
+# Each input line produces one output line of tab-separated columns: the
+# result and the error (syntax, div0, too_large or error), one of which is
+# empty. With
+# --unordered the line number of the expression is prepended, since results
+# are written as soon as their chunk is done.
+import argparse
+import itertools
+import os
+import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import costmodel as cm
+import evaluationworker as ew
+import expressionparser as ep
+import mathbackends as mb
+
+CACHE_SIZE = 1024
+
+_parser = None
+
+def evaluate_chunk(first_line, expressions, numbered=False):
+    '''
+    Evaluates a list of expressions with the parser of the current process.
+
+    first_line: the line number of the first expression
+    expressions: list of expression strings
+    numbered: whether to prepend the line number to each row
+
+    return: the output rows as a single string
+    '''
+    rows = []
+    for line_number, expression in enumerate(expressions, first_line):
+        status, value = ew.evaluate_expression(_parser, expression)
+        if status == ew.OK:
+            row = '%s\t' % ew.format_value(value)
+        else:
+            row = '\t%s' % status
+        if numbered:
+            row = '%d\t%s' % (line_number, row)
+        rows.append(row + '\n')
+    return ''.join(rows)
+
+def run(lines, output, jobs=None, chunk_size=1000, ordered=True,
+    use_degrees=False, max_bits=cm.DEFAULT_MAX_BITS, backend='math',
+    precision=None):
+    '''
+    Evaluates every line of an iterable and writes the results to output.
+    Only a bounded number of chunks is in flight at any time, so memory use
+    does not grow with the length of the input.
+    '''
+    jobs = jobs or os.cpu_count()
+    chunks = _read_chunks(lines, chunk_size)
+    numbered = not ordered
+
+    if jobs == 1:
+        _init_worker(use_degrees, max_bits, backend, precision)
+        for first_line, expressions in chunks:
+            output.write(evaluate_chunk(first_line, expressions, numbered))
+        output.flush()
+        return
+
+    with ProcessPoolExecutor(jobs, initializer=_init_worker,
+        initargs=(use_degrees, max_bits, backend, precision)) as pool:
+        pending = deque() if ordered else set()
+        for first_line, expressions in chunks:
+            if len(pending) >= 2 * jobs:
+                _write_finished(pending, output)
+            future = pool.submit(evaluate_chunk, first_line, expressions,
+                numbered)
+            if ordered:
+                pending.append(future)
+            else:
+                pending.add(future)
+        while pending:
+            _write_finished(pending, output)
+
+def _init_worker(use_degrees, max_bits, backend, precision):
+    global _parser
+    cm.cost_model.set_max_bits(max_bits)
+    _parser = ep.Parser(use_degrees, cache_size=CACHE_SIZE,
+        backend=mb.get_backend(backend, precision))
+
+def _read_chunks(lines, chunk_size):
+    lines = (line.rstrip('\r\n') for line in lines)
+    first_line = 1
+    while True:
+        expressions = list(itertools.islice(lines, chunk_size))
+        if not expressions:
+            return
+        yield first_line, expressions
+        first_line += len(expressions)
+
+def _write_finished(pending, output):
+    if isinstance(pending, deque):
+        output.write(pending.popleft().result())
+    else:
+        done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+            output.write(future.result())
+    output.flush()
+
+def main(args=None):
+    argparser = argparse.ArgumentParser(
+        description='Evaluate newline-delimited expressions.')
+    argparser.add_argument('file', nargs='?',
+        help='file of expressions, one per line (default: stdin)')
+    argparser.add_argument('--degrees', action='store_true',
+        help='take trigonometric arguments in degrees')
+    argparser.add_argument('--jobs', type=int, default=None,
+        help='number of worker processes (default: number of cores)')
+    argparser.add_argument('--chunk-size', type=int, default=1000,
+        help='number of lines sent to a worker at a time')
+    argparser.add_argument('--max-bits', type=int, default=cm.DEFAULT_MAX_BITS,
+        help='largest bit length of an integer result of ^ or !')
+    argparser.add_argument('--backend', choices=['math', 'numpy', 'mpmath'],
+        default='math', help='math backend of the evaluation')
+    argparser.add_argument('--precision', type=int, default=None,
+        help='significant digits of the mpmath backend (default: 50)')
+    argparser.add_argument('--unordered', action='store_true',
+        help='write results as soon as they are ready, prefixed by line number')
+    args = argparser.parse_args(args)
+
+    if args.file:
+        lines = open(args.file)
+    else:
+        lines = sys.stdin
+    with lines:
+        run(lines, sys.stdout, args.jobs, args.chunk_size,
+            not args.unordered, args.degrees, args.max_bits, args.backend,
+            args.precision)
+
+if __name__ == '__main__':
+    main()
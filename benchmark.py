@@ -0,0 +1,125 @@
+# Times the hot paths of the calculator on reproducible workloads: parsing,
+# evaluation, conversion to strings and pushing to the Model's history.
+#
+# usage: python benchmark.py [--repeat N] [--output FILE] [--baseline FILE]
+#
+# Results are written as JSON. When a baseline file produced by an earlier run
+# is given, the ratio of each timing to the baseline is printed.
+import argparse
+import json
+import platform
+import random
+import time
+import expressionparser as ep
+from model import Model
+
+SEED = 1234
+
+def make_workloads():
+    '''
+    Return a dict mapping workload names to lists of expressions. The same
+    expressions are generated on every run.
+    '''
+    rng = random.Random(SEED)
+    return {
+        'deep_nesting': ['(' * 150 + '1' + '+1)' * 150],
+        'long_flat_sum': ['+'.join(str(rng.randrange(1000)) for i in range(300))],
+        'heavy_trig': ['+'.join('%s(%d)*%s(%d)' % (rng.choice(['sin', 'cos', 'tan']),
+            rng.randrange(360), rng.choice(['sin', 'cos', 'tan']),
+            rng.randrange(360)) for i in range(100))],
+        'big_factorials_and_powers': ['3000!', '7^20000', '(300!)^5+2^12345'],
+        'many_short': ['%d%s%d%s%d' % (rng.randrange(100), rng.choice('+-*/^'),
+            rng.randrange(1, 100), rng.choice('+-*/'), rng.randrange(1, 100))
+            for i in range(1000)]
+    }
+
+def time_phases(expressions, repeat):
+    '''
+    Return the best time in seconds of each phase over the given number of
+    repetitions. Every repetition parses fresh trees so that evaluation is
+    not served from the cached values of the previous one.
+    '''
+    parser = ep.Parser()
+    timings = {'parse': [], 'evaluate': [], 'stringify': []}
+    for i in range(repeat):
+        start = time.perf_counter()
+        operations = [parser.parse(expression) for expression in expressions]
+        timings['parse'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for operation in operations:
+            operation.get_value()
+        timings['evaluate'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for operation in operations:
+            str(operation)
+        timings['stringify'].append(time.perf_counter() - start)
+    return {phase: min(times) for phase, times in timings.items()}
+
+def time_history_push(expressions, repeat):
+    '''
+    Return the best time in seconds to push the expressions to the history
+    of a Model, as done on '='.
+    '''
+    times = []
+    for i in range(repeat):
+        model = Model()
+        start = time.perf_counter()
+        for expression in expressions:
+            model.set_operation_from_expression(expression)
+            model.push_operation_to_history('')
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def run(repeat):
+    results = {}
+    for name, expressions in make_workloads().items():
+        results[name] = time_phases(expressions, repeat)
+        results[name]['history_push'] = time_history_push(expressions, repeat)
+    return {
+        'python': platform.python_version(),
+        'repeat': repeat,
+        'results': results
+    }
+
+def compare(report, baseline):
+    '''
+    Print each timing of the report with its ratio to the baseline. Ratios
+    below 1 are speedups.
+    '''
+    print('%-28s %-14s %12s %12s %8s' % ('workload', 'phase', 'seconds',
+        'baseline', 'ratio'))
+    for name, phases in report['results'].items():
+        for phase, seconds in phases.items():
+            try:
+                old_seconds = baseline['results'][name][phase]
+            except KeyError:
+                print('%-28s %-14s %12.6f %12s %8s' % (name, phase, seconds,
+                    '-', '-'))
+            else:
+                ratio = seconds / old_seconds if old_seconds else float('inf')
+                print('%-28s %-14s %12.6f %12.6f %8.3f' % (name, phase,
+                    seconds, old_seconds, ratio))
+
+def main(args=None):
+    argparser = argparse.ArgumentParser(
+        description='Benchmark parsing, evaluation and rendering.')
+    argparser.add_argument('--repeat', type=int, default=5,
+        help='repetitions of each measurement; the best is kept')
+    argparser.add_argument('--output', help='write the results to this JSON file')
+    argparser.add_argument('--baseline', help='JSON results to compare against')
+    args = argparser.parse_args(args)
+
+    report = run(args.repeat)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            compare(report, json.load(baseline))
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
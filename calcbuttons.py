@@ -29,10 +29,16 @@ class Layouts(Enum):
 
 
 class ButtonPanel(Frame):
+    # The font last given to the global TButton style. Reconfiguring the
+    # style restyles every existing button, so it is only done on a change.
+    styled_font = None
+
     def __init__(self, master, layout, font=('Segoe UI', 14)):
         Frame.__init__(self, master)
-        s = ttk.Style()
-        s.configure('TButton', font=font)
+        if font != ButtonPanel.styled_font:
+            s = ttk.Style()
+            s.configure('TButton', font=font)
+            ButtonPanel.styled_font = font
         self.button_layout = layout.value
         self.buttons = {}
         self.create_buttons()
@@ -0,0 +1,100 @@
+# Estimates the size of the results of powers and factorials before they are
+# computed, so that an expression such as 9^9^9 is refused instead of
+# exhausting memory while Python builds an integer with billions of digits.
+import math
+
+DEFAULT_MAX_BITS = 1 << 20
+
+class ResultTooLargeError(ArithmeticError):
+    def __init__(self, bits):
+        '''
+        Initializes a ResultTooLargeError object.
+
+        bits: the estimated bit length of the refused result, or math.inf
+            if it is too large to estimate
+        '''
+        if bits == math.inf:
+            message = 'result too large to estimate'
+        else:
+            message = 'result of about %d bits' % bits
+        ArithmeticError.__init__(self, message)
+        self.bits = bits
+
+    def get_digits(self):
+        '''
+        Return the estimated number of decimal digits of the refused result,
+        or math.inf if it is too large to estimate.
+        '''
+        if self.bits == math.inf:
+            return math.inf
+        return int(self.bits * math.log10(2)) + 1
+
+
+class CostModel:
+    '''
+    Guarded versions of the power and factorial functions. Integer results
+    whose estimated bit length exceeds max_bits are not computed and raise
+    ResultTooLargeError instead. Float results are unaffected, since their
+    size is fixed and an overflow already raises OverflowError.
+    '''
+    def __init__(self, max_bits=DEFAULT_MAX_BITS):
+        '''
+        Initializes a CostModel object.
+
+        max_bits: the largest bit length of an integer result
+        '''
+        self.max_bits = max_bits
+
+    def get_max_bits(self):
+        return self.max_bits
+
+    def set_max_bits(self, max_bits):
+        self.max_bits = max_bits
+
+    def estimate_power_bits(self, base, exponent):
+        '''
+        Return the estimated bit length of base ** exponent, or 0 if the
+        result is not an integer which grows with the exponent. An estimate
+        which overflows a float is math.inf.
+        '''
+        if type(base) is not int or type(exponent) is not int or \
+            exponent < 2 or -1 <= base <= 1:
+                return 0
+        try:
+            return exponent * math.log2(abs(base))
+        except OverflowError:
+            return math.inf
+
+    def estimate_factorial_bits(self, n):
+        '''
+        Return the estimated bit length of n!, or 0 if n is not a positive
+        integer. The logarithm of n! is taken from the log-gamma function,
+        which follows Stirling's approximation for large n.
+        '''
+        if type(n) is not int or n < 2:
+            return 0
+        try:
+            return math.lgamma(n + 1) / math.log(2)
+        except OverflowError:
+            return math.inf
+
+    def power(self, base, exponent):
+        self._check(self.estimate_power_bits(base, exponent))
+        result = base ** exponent
+        # A negative number to a fractional power is complex, a domain error
+        # as for the functions of the math module.
+        if type(result) is complex:
+            raise ValueError('math domain error')
+        return result
+
+    def factorial(self, n):
+        self._check(self.estimate_factorial_bits(n))
+        return math.factorial(n)
+
+    def _check(self, bits):
+        if bits > self.max_bits:
+            raise ResultTooLargeError(bits)
+
+
+# The cost model of the '^' and '!' operators of every Parser.
+cost_model = CostModel()
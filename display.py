@@ -36,32 +36,165 @@ class InputLine(tk.Frame):
 
 
 class HistoryDisplay(tk.Frame):
-    def __init__(self, master, entry_callback, rows=4):
+    LOAD_SIZE = 32
+
+    def __init__(self, master, entry_callback, rows=4, max_entries=None):
+        '''
+        Initializes a HistoryDisplay object. The display is a scrollable list
+        of entries, the newest at the bottom, of which only rows are visible.
+        Entries are kept as strings, and a pool of one OperationView per
+        visible row is rebound to the visible entries when the list scrolls,
+        so the cost of showing it does not depend on the number of entries.
+
+        master: a tkinter widget
+        entry_callback: function called with the input or result string of
+            an entry when it is clicked
+        rows: the number of visible rows
+        max_entries: the number of entries which can be scrolled through, or
+            None to keep all of them
+        '''
         tk.Frame.__init__(self, master)
         self.num_rows = rows
-        self.operation_views = [OperationView(self, entry_callback) for i in range(rows)]
+        self.max_entries = max_entries
+        # Oldest entry first.
+        self.entries = []
+        # Index in entries of the entry in the top row. It is negative when
+        # there are fewer entries than rows, leaving the top rows empty.
+        self.first = -rows
+        self.loader = None
+        self.row_frame = tk.Frame(self)
+        self.operation_views = [OperationView(self.row_frame, entry_callback)
+            for i in range(rows)]
+        self.scrollbar = tk.Scrollbar(self, orient='vertical',
+            command=self.yview)
+        self._bind_wheel(self.row_frame)
+        for view in self.operation_views:
+            for widget in (view, view.input_view, view.result_view):
+                self._bind_wheel(widget)
         self.show()
 
     def get_num_rows(self):
         return self.num_rows
 
-    def set_entry(self, row, input_string, result_string):
-        self.operation_views[row].set_input_string(input_string)
-        self.operation_views[row].set_result_string(result_string)
+    def set_loader(self, loader):
+        '''
+        Set the function called with a number of entries when the list is
+        scrolled near its oldest entry, returning up to that many older
+        (input_string, result_string) tuples, newest first. Older entries
+        are only loaded once they are about to be shown.
+        '''
+        self.loader = loader
+
+    def push_entry(self, input_string, result_string):
+        '''
+        Add a new entry below the others. If the newest entry was visible,
+        the display scrolls to show the new one.
+        '''
+        at_bottom = self.first == self._get_last_first()
+        self.entries.append((input_string, result_string))
+        if self.max_entries is not None and \
+            len(self.entries) > 2 * self.max_entries:
+                # Dropping the oldest entries in bulk keeps pushing O(1).
+                dropped = len(self.entries) - self.max_entries
+                del self.entries[:dropped]
+                self.first -= dropped
+        if at_bottom:
+            self.first = self._get_last_first()
+        else:
+            self.first = max(self.first, self._get_offset())
+        self._refresh()
+
+    def scroll(self, rows):
+        '''
+        Scroll by a number of rows, towards older entries if negative.
+        '''
+        self._scroll_to(self.first + rows)
 
     def show(self):
-        for view in reversed(self.operation_views):
+        for view in self.operation_views:
             view.pack()
+        self.row_frame.pack(side='left', expand=True, fill='x')
+        self.scrollbar.pack(side='right', fill='y')
+        self._refresh()
+
+    def yview(self, *args):
+        '''
+        Scroll as requested by the scrollbar, with the arguments of the
+        yview method of scrollable tkinter widgets.
+        '''
+        if args[0] == 'moveto':
+            self._scroll_to(self._get_offset() + round(float(args[1]) *
+                self._get_num_positions()))
+        elif args[0] == 'scroll':
+            rows = int(args[1])
+            if args[2] == 'pages':
+                rows *= self.num_rows
+            self.scroll(rows)
+
+    def _bind_wheel(self, widget):
+        widget.bind('<MouseWheel>',
+            lambda event: self.scroll(-1 if event.delta > 0 else 1))
+        widget.bind('<Button-4>', lambda event: self.scroll(-1))
+        widget.bind('<Button-5>', lambda event: self.scroll(1))
+
+    def _get_last_first(self):
+        # The first index when the newest entry is in the bottom row.
+        return len(self.entries) - self.num_rows
+
+    def _get_num_positions(self):
+        return len(self.entries) - self._get_offset()
+
+    def _load_older(self):
+        # Adds a batch of older entries above the others, returning their
+        # number. The loader is dropped once it has no more entries.
+        count = HistoryDisplay.LOAD_SIZE
+        if self.max_entries is not None:
+            count = min(count, self.max_entries - len(self.entries))
+        older = self.loader(count) if count > 0 else []
+        if not older:
+            self.loader = None
+        self.entries[:0] = reversed(older)
+        self.first += len(older)
+        return len(older)
+
+    def _get_offset(self):
+        # The first index when the oldest entry kept is in the top row, or
+        # the top rows are empty.
+        oldest = 0
+        if self.max_entries is not None:
+            oldest = max(len(self.entries) - self.max_entries, 0)
+        return min(oldest, self._get_last_first())
+
+    def _refresh(self):
+        # Rebinds the views to the visible entries. Views whose entry has not
+        # changed are left untouched.
+        for row, view in enumerate(self.operation_views):
+            index = self.first + row
+            if 0 <= index < len(self.entries):
+                view.set_entry(*self.entries[index])
+            else:
+                view.clear()
+        positions = self._get_num_positions()
+        top = self.first - self._get_offset()
+        self.scrollbar.set(top / positions, (top + self.num_rows) / positions)
+
+    def _scroll_to(self, first):
+        if self.loader and first < self._get_offset() + self.num_rows:
+            first += self._load_older()
+        first = max(self._get_offset(), min(first, self._get_last_first()))
+        if first != self.first:
+            self.first = first
+            self._refresh()
 
 
 class OperationView(tk.Frame):
     def __init__(self, master, callback):
         tk.Frame.__init__(self, master)
         self.input_string = ''
-        self.result_string = ''
+        self.result_string = None
         self.input_view = tk.Button(self, text=self.input_string, 
             relief='flat', borderwidth=0, command=self.call_input)
-        self.result_view = tk.Button(self, text=self.result_string, 
+        self.result_view = tk.Button(self, text='', 
             relief='flat', borderwidth=0, command=self.call_result)
         self.callback = callback
         self.show()
@@ -70,18 +203,32 @@ class OperationView(tk.Frame):
         return self.callback(self.input_string)
     
     def call_result(self):
-        return self.callback(self.result_string)
+        if self.result_string is not None:
+            return self.callback(self.result_string)
+
+    def clear(self):
+        self.set_entry('', None)
 
     def set_callback(self, callback):
         self.callback = callback
 
+    def set_entry(self, input_string, result_string):
+        '''
+        Show an entry, reconfiguring only the buttons whose text changes.
+        result_string is None for an empty row.
+        '''
+        if input_string != self.input_string:
+            self.set_input_string(input_string)
+        if result_string != self.result_string:
+            self.set_result_string(result_string)
+
     def set_input_string(self, string):
         self.input_string = string
         self.input_view.config(text=string)
 
     def set_result_string(self, string):
         self.result_string = string
-        self.result_view.config(text='= ' + string)
+        self.result_view.config(text='' if string is None else '= ' + string)
 
     def show(self):
         self.input_view.grid(column=0, row=0, columnspan=3, sticky='ew')
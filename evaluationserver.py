@@ -0,0 +1,336 @@
+# Serves the calculator's evaluation to other programs over a local TCP or Unix
+# socket, with the same precedence, postfix operators, angle modes and limits
+# as the GUI.
+#
+# The protocol is newline-delimited JSON. Each request is an object with an
+# "id", echoed in its response, and either an "expression" to evaluate or an
+# "angle_mode" ("deg" or "rad") which applies to the later requests of the
+# connection. Connections start in radians. Responses have the "id", a
+# "status" (ok, syntax, div0, too_large, error, timeout or bad_request) and,
+# for an expression evaluated successfully, its "result" as shown by the GUI:
+#
+#   {"id": 1, "angle_mode": "deg"}      {"id": 1, "status": "ok"}
+#   {"id": 2, "expression": "sin(90)"}  {"id": 2, "status": "ok", "result": "1.0"}
+#
+# Clients may send any number of requests without waiting for responses. The
+# requests which have arrived by the time the event loop gets to them are
+# evaluated as one batch, whose responses are sent with a single write. Only
+# results small enough to compute in microseconds are evaluated on the event
+# loop. Expressions longer than INLINE_MAX_LENGTH, whose products of large
+# integers can take arbitrarily long, and powers and factorials whose result
+# would exceed INLINE_MAX_BITS are sent to a process pool, so their
+# responses can come after those of later requests. Responses are matched
+# to requests by id.
+import argparse
+import asyncio
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import costmodel as cm
+import evaluationworker as ew
+import expressionparser as ep
+import mathbackends as mb
+import model as md
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 7419
+CACHE_SIZE = 1024
+# The largest bit length of an integer result of '^' or '!' computed on the
+# event loop.
+INLINE_MAX_BITS = 1 << 14
+# The longest expression evaluated on the event loop. Only powers and
+# factorials are limited by INLINE_MAX_BITS, so this bounds the number of
+# operations on integers of that size, and the time they take to a few
+# milliseconds.
+INLINE_MAX_LENGTH = 128
+BATCH_SIZE = 256
+MAX_PENDING = 4 * BATCH_SIZE
+MAX_LINE_LENGTH = 1 << 16
+
+BAD_REQUEST = 'bad_request'
+
+_pool_parsers = None
+
+class EvaluationServer:
+    def __init__(self, jobs=None, time_budget=10.0,
+        max_bits=cm.DEFAULT_MAX_BITS, backend='math', precision=None):
+        '''
+        Initializes an EvaluationServer object. The process pool is started
+        by start or start_unix.
+
+        jobs: the number of processes evaluating large results (default:
+            number of cores)
+        time_budget: seconds a request sent to the process pool may take
+            before it is answered with the timeout status. The process keeps
+            computing it, since it cannot be interrupted.
+        max_bits: the largest bit length of an integer result of '^' or '!'
+        backend, precision: the name of the math backend and its precision,
+            as taken by mathbackends.get_backend
+        '''
+        self.jobs = jobs or os.cpu_count()
+        self.time_budget = time_budget
+        self.max_bits = max_bits
+        self.backend = backend
+        self.precision = precision
+        math_backend = mb.get_backend(backend, precision)
+        # One parser per angle mode, shared by all connections.
+        self.parsers = {use_degrees: ep.Parser(use_degrees,
+            cache_size=CACHE_SIZE, backend=math_backend)
+            for use_degrees in (False, True)}
+        self.pool = None
+        self.server = None
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def evaluate_batch(self, requests):
+        '''
+        Evaluates a list of (expression, use_degrees) tuples on the calling
+        thread, leaving out long expressions and large results.
+
+        return: a list with a (status, string) tuple for each request, or
+            None for those which have to be evaluated by evaluate_large
+        '''
+        results = []
+        max_bits = cm.cost_model.get_max_bits()
+        cm.cost_model.set_max_bits(min(INLINE_MAX_BITS, self.max_bits))
+        try:
+            for expression, use_degrees in requests:
+                if len(expression) > INLINE_MAX_LENGTH:
+                    results.append(None)
+                    continue
+                status, value = ew.evaluate_expression(
+                    self.parsers[use_degrees], expression)
+                if status == ew.TOO_LARGE:
+                    results.append(None)
+                elif status == ew.OK:
+                    results.append((status, ew.format_value(value)))
+                else:
+                    results.append((status, None))
+        finally:
+            cm.cost_model.set_max_bits(max_bits)
+        return results
+
+    async def evaluate_large(self, expression, use_degrees):
+        '''
+        Evaluates an expression in the process pool.
+
+        return: a (status, string) tuple
+        '''
+        future = asyncio.get_running_loop().run_in_executor(self.pool,
+            _evaluate_in_pool, expression, use_degrees)
+        try:
+            return await asyncio.wait_for(future, self.time_budget)
+        except asyncio.TimeoutError:
+            return ew.TIMEOUT, None
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        '''
+        Start serving on a TCP socket.
+
+        return: the asyncio Server
+        '''
+        self._start_pool()
+        self.server = await asyncio.get_running_loop().create_server(
+            lambda: _Connection(self), host, port)
+        return self.server
+
+    async def start_unix(self, path):
+        '''
+        Start serving on a Unix socket.
+
+        return: the asyncio Server
+        '''
+        self._start_pool()
+        self.server = await asyncio.get_running_loop().create_unix_server(
+            lambda: _Connection(self), path)
+        return self.server
+
+    def _start_pool(self):
+        if not self.pool:
+            self.pool = ProcessPoolExecutor(self.jobs,
+                initializer=_init_pool_worker,
+                initargs=(self.max_bits, self.backend, self.precision))
+
+
+class _Connection(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.use_degrees = False
+        self.buffer = b''
+        self.pending = deque()
+        self.batch_handle = None
+        self.reading_paused = False
+        self.writing_paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        if self.batch_handle:
+            self.batch_handle.cancel()
+            self.batch_handle = None
+        self.pending.clear()
+
+    def data_received(self, data):
+        lines = (self.buffer + data).split(b'\n')
+        self.buffer = lines.pop()
+        if len(self.buffer) > MAX_LINE_LENGTH:
+            self.transport.write(_encode_response(None, BAD_REQUEST))
+            self.transport.close()
+            return
+        self.pending.extend(lines)
+        if len(self.pending) > MAX_PENDING and not self.reading_paused:
+            self.reading_paused = True
+            self.transport.pause_reading()
+        self._schedule_batch()
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+        self._schedule_batch()
+
+    def _process_batch(self):
+        # Takes the requests received so far, up to BATCH_SIZE, and answers
+        # those evaluated inline with one write.
+        self.batch_handle = None
+        if self.writing_paused or self.transport.is_closing():
+            return
+        # Responses of the requests evaluated inline keep their order.
+        responses = []
+        requests = []
+        for i in range(min(BATCH_SIZE, len(self.pending))):
+            request = self._read_request(self.pending.popleft())
+            if isinstance(request, bytes):
+                responses.append(request)
+            elif request:
+                requests.append((len(responses), request))
+                responses.append(None)
+
+        results = self.server.evaluate_batch([(expression, use_degrees)
+            for index, (request_id, expression, use_degrees) in requests])
+        for (index, request), result in zip(requests, results):
+            if result is None:
+                asyncio.ensure_future(self._evaluate_large(*request))
+                responses[index] = b''
+            else:
+                responses[index] = _encode_response(request[0], *result)
+        data = b''.join(responses)
+        if data:
+            self.transport.write(data)
+
+        if self.pending:
+            self._schedule_batch()
+        elif self.reading_paused:
+            self.reading_paused = False
+            self.transport.resume_reading()
+
+    async def _evaluate_large(self, request_id, expression, use_degrees):
+        status, string = await self.server.evaluate_large(expression,
+            use_degrees)
+        if not self.transport.is_closing():
+            self.transport.write(_encode_response(request_id, status, string))
+
+    def _read_request(self, line):
+        # Return the (id, expression, use_degrees) of an expression request,
+        # None for a blank line, or the encoded response of any other line.
+        if not line.strip():
+            return None
+        request = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            if 'expression' in request:
+                expression = request['expression']
+                if not isinstance(expression, str):
+                    raise TypeError
+                return request_id, expression, self.use_degrees
+            self.use_degrees = md.Model.ANGLE_MODES[request['angle_mode']]
+            return _encode_response(request_id, ew.OK)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            request_id = request.get('id') if isinstance(request, dict) else None
+            return _encode_response(request_id, BAD_REQUEST)
+
+    def _schedule_batch(self):
+        # The batch runs in a later iteration of the event loop, so that it
+        # includes every request which arrives in the current one.
+        if not self.batch_handle and self.pending:
+            self.batch_handle = asyncio.get_running_loop().call_soon(
+                self._process_batch)
+
+
+def _encode_response(request_id, status, result=None):
+    response = {'id': request_id, 'status': status}
+    if result is not None:
+        response['result'] = result
+    return json.dumps(response).encode('utf-8') + b'\n'
+
+def _init_pool_worker(max_bits, backend, precision):
+    global _pool_parsers
+    cm.cost_model.set_max_bits(max_bits)
+    math_backend = mb.get_backend(backend, precision)
+    _pool_parsers = {use_degrees: ep.Parser(use_degrees,
+        cache_size=CACHE_SIZE, backend=math_backend)
+        for use_degrees in (False, True)}
+
+def _evaluate_in_pool(expression, use_degrees):
+    # Formats the result in the worker, since converting a large integer to
+    # a string takes longer than computing it.
+    status, value = ew.evaluate_expression(_pool_parsers[use_degrees],
+        expression)
+    return status, ew.format_value(value) if status == ew.OK else None
+
+async def serve(server, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+    '''
+    Serve with an EvaluationServer until cancelled, on the Unix socket path
+    if given and the TCP socket host:port otherwise.
+    '''
+    try:
+        if path:
+            listener = await server.start_unix(path)
+        else:
+            listener = await server.start(host, port)
+        await listener.serve_forever()
+    finally:
+        await server.close()
+
+def main(args=None):
+    argparser = argparse.ArgumentParser(
+        description='Serve expression evaluation as newline-delimited JSON.')
+    argparser.add_argument('--host', default=DEFAULT_HOST,
+        help='address of the TCP socket (default: %s)' % DEFAULT_HOST)
+    argparser.add_argument('--port', type=int, default=DEFAULT_PORT,
+        help='port of the TCP socket (default: %d)' % DEFAULT_PORT)
+    argparser.add_argument('--unix', metavar='PATH',
+        help='listen on a Unix socket instead of TCP')
+    argparser.add_argument('--jobs', type=int, default=None,
+        help='number of processes evaluating large results (default: number of cores)')
+    argparser.add_argument('--time-budget', type=float, default=10.0,
+        help='seconds a large result may take before timing out')
+    argparser.add_argument('--max-bits', type=int, default=cm.DEFAULT_MAX_BITS,
+        help='largest bit length of an integer result of ^ or !')
+    argparser.add_argument('--backend', choices=['math', 'numpy', 'mpmath'],
+        default='math', help='math backend of the evaluation')
+    argparser.add_argument('--precision', type=int, default=None,
+        help='significant digits of the mpmath backend (default: 50)')
+    args = argparser.parse_args(args)
+
+    server = EvaluationServer(args.jobs, args.time_budget, args.max_bits,
+        args.backend, args.precision)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+# Evaluates expressions in a separate process, so that huge powers and
+# factorials never block the tkinter mainloop and can be abandoned when they
+# are no longer needed.
+import math
+import time
+import costmodel as cm
+import expressionparser as ep
+import mathbackends as mb
+
+OK = 'ok'
+SYNTAX_ERROR = 'syntax'
+ZERO_DIVISION = 'div0'
+MATH_ERROR = 'error'
+TOO_LARGE = 'too_large'
+TIMEOUT = 'timeout'
+
+def evaluate_expression(parser, expression):
+    '''
+    Parses and evaluates an expression.
+
+    parser: the Parser used to parse the expression
+    expression: string containing the expression
+
+    return: a (status, value) tuple. status is OK, SYNTAX_ERROR,
+        ZERO_DIVISION, TOO_LARGE or MATH_ERROR and value is None unless
+        status is OK.
+    '''
+    try:
+        operation = parser.parse(expression)
+    except (ep.MathSyntaxError, ep.UnexpectedOperandError, ValueError):
+        return SYNTAX_ERROR, None
+
+    try:
+        if operation is None:
+            raise ep.MathSyntaxError
+        return OK, operation.get_value()
+    except (ep.MathSyntaxError, AttributeError):
+        return SYNTAX_ERROR, None
+    except ZeroDivisionError:
+        return ZERO_DIVISION, None
+    except cm.ResultTooLargeError:
+        return TOO_LARGE, None
+    except (ArithmeticError, ValueError, TypeError):
+        return MATH_ERROR, None
+
+
+def format_value(value):
+    '''
+    Return the string shown for a result. Integers too long to convert to a
+    decimal string are shown in scientific notation.
+    '''
+    try:
+        return str(value)
+    except ValueError:
+        shift = max(value.bit_length() - 64, 0)
+        exponent = math.log10(abs(value) >> shift) + shift * math.log10(2)
+        mantissa = 10 ** (exponent - math.floor(exponent))
+        sign = '-' if value < 0 else ''
+        return '%s%.10ge+%d' % (sign, mantissa, math.floor(exponent))
+
+
+class EvaluationWorker:
+    CACHE_SIZE = 64
+
+    def __init__(self, time_budget=2.0, max_bits=cm.DEFAULT_MAX_BITS,
+        backend='math', precision=None, count_calls=False):
+        '''
+        Initializes an EvaluationWorker object. The worker process is started
+        by the first call to submit.
+
+        time_budget: seconds an evaluation may take before it is abandoned
+        max_bits: the largest bit length of an integer result of '^' or '!'
+            computed by the worker
+        backend, precision: the name of the math backend of the worker's
+            parser and its precision, as taken by mathbackends.get_backend
+        count_calls: whether the worker process counts the calls of the
+            methods of instrumentation.COUNTED_METHODS, returned by
+            get_counts
+        '''
+        self.time_budget = time_budget
+        self.max_bits = max_bits
+        self.backend = backend
+        self.precision = precision
+        self.count_calls = count_calls
+        self.process = None
+        self.connection = None
+        self.request_id = 0
+        self.pending_id = None
+        self.start_time = None
+        self.timings = None
+        self.counts = None
+
+    def cancel(self):
+        '''
+        Abandon the pending evaluation. A computation cannot be interrupted
+        inside the worker, so the process is terminated and a new one is
+        started by the next call to submit.
+        '''
+        if self.is_busy():
+            self.stop()
+
+    def get_counts(self):
+        '''
+        Return a dict of the calls of each counted method made by the worker
+        process for the last result returned by poll, or None if it timed
+        out or calls are not counted.
+        '''
+        return self.counts
+
+    def get_elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def get_timings(self):
+        '''
+        Return the (evaluate, stringify) durations in seconds measured by the
+        worker process for the last result returned by poll, or None if it
+        timed out. evaluate includes parsing in the worker.
+        '''
+        return self.timings
+
+    def is_busy(self):
+        return self.pending_id is not None
+
+    def poll(self):
+        '''
+        Return the (status, value, string, input_string) result of the
+        pending evaluation, or None if there is none yet. string is the value
+        formatted by format_value and input_string is the parsed expression
+        as written by str, both None unless status is OK. An evaluation
+        exceeding the time budget is cancelled and reported with the TIMEOUT
+        status.
+        '''
+        if not self.is_busy():
+            return None
+        while self.connection.poll():
+            request_id, result, timings, counts = self.connection.recv()
+            if request_id == self.pending_id:
+                self.pending_id = None
+                self.timings = timings
+                self.counts = counts
+                return result
+        if self.get_elapsed() > self.time_budget:
+            self.cancel()
+            self.timings = None
+            self.counts = None
+            return TIMEOUT, None, None, None
+        return None
+
+    def set_time_budget(self, time_budget):
+        self.time_budget = time_budget
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.join()
+            self.connection.close()
+        self.process = None
+        self.connection = None
+        self.pending_id = None
+
+    def submit(self, expression, use_degrees=False):
+        '''
+        Start evaluating an expression, replacing any pending evaluation.
+
+        return: the id of the request
+        '''
+        if self.is_busy():
+            self.poll()
+        self.cancel()
+        if not self.process:
+            self._start()
+
+        self.request_id += 1
+        self.connection.send((self.request_id, expression, use_degrees))
+        self.pending_id = self.request_id
+        self.start_time = time.monotonic()
+        return self.request_id
+
+    def _start(self):
+        # Imported here since it takes a noticeable part of the startup time
+        # and is not needed until the first expression is evaluated.
+        import multiprocessing
+        self.connection, worker_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_serve,
+            args=(worker_connection, self.max_bits, self.backend,
+            self.precision, self.count_calls), daemon=True)
+        self.process.start()
+        worker_connection.close()
+
+
+def _serve(connection, max_bits, backend, precision, count_calls):
+    cm.cost_model.set_max_bits(max_bits)
+    if count_calls:
+        # Only imported when needed, since importing it with instrumentation
+        # enabled by the environment wraps the counted methods.
+        import instrumentation as ins
+        ins.instrumentation.reset()
+        ins.instrumentation.enable()
+    parser = ep.IncrementalParser(cache_size=EvaluationWorker.CACHE_SIZE,
+        backend=mb.get_backend(backend, precision))
+    while True:
+        try:
+            request_id, expression, use_degrees = connection.recv()
+        except EOFError:
+            break
+        if use_degrees != parser.trig_config.use_degrees:
+            parser.set_use_degrees(use_degrees)
+        start_time = time.perf_counter()
+        status, value = evaluate_expression(parser, expression)
+        evaluated_time = time.perf_counter()
+        string = input_string = None
+        if status == OK:
+            string = format_value(value)
+            # The tree is taken from the parse cache. Writing it here spares
+            # the controller parsing every preview again.
+            input_string = str(parser.parse(expression))
+        timings = (evaluated_time - start_time,
+            time.perf_counter() - evaluated_time)
+        counts = None
+        if count_calls:
+            counts = ins.instrumentation.get_stats()['counts']
+            ins.instrumentation.reset()
+        connection.send((request_id, (status, value, string, input_string),
+            timings, counts))
@@ -0,0 +1,101 @@
+# Compiles Operation trees into flat Python functions so that expressions
+# which are evaluated repeatedly skip the method calls of the tree walk.
+import expressionparser as ep
+
+# '^' is called through its function, which refuses results too large to
+# compute.
+INLINE_OPERATORS = {
+    '+': '+',
+    '-': '-',
+    '*': '*',
+    '/': '/'
+}
+
+def compile_operation(operation):
+    '''
+    Compiles an operation tree into a function of no arguments which returns
+    the value of the expression.
+
+    The function evaluates the operands in the same order as
+    Operation.get_value, so it raises the same ZeroDivisionError for a
+    division by zero and MathSyntaxError where an operand is missing.
+
+    A node reached more than once, as in the trees returned by
+    expressioninterner.Interner.intern, is computed once per call.
+
+    operation: the Operand returned by Parser.parse, or None
+
+    return: a callable returning the value of the expression
+    '''
+    return _Compiler().compile(operation)
+
+
+class _Compiler:
+    def __init__(self):
+        self.lines = []
+        self.namespace = {'MathSyntaxError': ep.MathSyntaxError}
+        self.num_temporaries = 0
+
+    def compile(self, operation):
+        result = self._generate(operation)
+        source = 'def _make(%s):\n    def compiled():\n%s\n        return %s\n    return compiled' % (
+            ', '.join(self.namespace),
+            '\n'.join('        ' + line for line in self.lines) or '        pass',
+            result)
+        code = {}
+        exec(source, {}, code)
+        return code['_make'](**self.namespace)
+
+    def _add_name(self, prefix, value):
+        name = '%s%d' % (prefix, len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def _add_line(self, expression):
+        name = 't%d' % self.num_temporaries
+        self.num_temporaries += 1
+        self.lines.append('%s = %s' % (name, expression))
+        return name
+
+    def _generate(self, operation):
+        # generated maps the ids of the nodes already compiled to their
+        # results, so that shared subtrees are compiled once.
+        results = []
+        generated = {}
+
+        def is_generated(operation):
+            return id(operation) in generated
+
+        for node in ep.walk_post_order(operation, is_generated):
+            if id(node) in generated:
+                results.append(generated[id(node)])
+                continue
+            if node is None:
+                self.lines.append('raise MathSyntaxError')
+                results.append('None')
+                continue
+            if isinstance(node, ep.InfixOperation):
+                second = results.pop()
+                first = results.pop()
+                results.append(self._generate_infix(node, first, second))
+            elif isinstance(node, ep.PostfixOperation):
+                operand = results.pop()
+                function = self._add_name('f', node.operator.get_function())
+                results.append(self._add_line('%s(%s)' % (function, operand)))
+            elif type(node) in (ep.Operand, ep.Constant):
+                results.append(self._add_name('k', node.get_value()))
+            else:
+                getter = self._add_name('g', node.get_value)
+                results.append(self._add_line('%s()' % getter))
+            generated[id(node)] = results[-1]
+        return results.pop()
+
+    def _generate_infix(self, operation, first, second):
+        symbol = operation.operator.symbol
+        function = operation.operator.get_function()
+        default = ep.Parser.INFIX_OPERATORS.get(symbol)
+        if symbol in INLINE_OPERATORS and default and function is default['func']:
+            return self._add_line('%s %s %s' % (first, INLINE_OPERATORS[symbol], second))
+        else:
+            function = self._add_name('f', function)
+            return self._add_line('%s(%s, %s)' % (function, first, second))
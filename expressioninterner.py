@@ -0,0 +1,145 @@
+# Shares structurally identical subtrees of Operation trees. An interned tree
+# is a DAG in which every distinct subexpression is a single node, so that
+# expressions such as sin(x)^2+sin(x)*cos(x)+sin(x) hold sin(x) once and can
+# evaluate it once.
+import math
+import weakref
+import expressionparser as ep
+import trigconfig as tc
+
+class Interner:
+    '''
+    Table of interned nodes. Two subtrees are identical when they have the
+    same type, the same Operator object and identical operands, or are
+    leaves of the same type and value. Since Parsers share one Operator per
+    symbol and angle mode, trees from the same Parser are interned together
+    while functions of different angle modes are kept apart.
+
+    The table only holds weak references, so nodes are freed once no tree
+    uses them.
+    '''
+    def __init__(self):
+        self.nodes = weakref.WeakValueDictionary()
+
+    def clear(self):
+        self.nodes.clear()
+
+    def get_size(self):
+        return len(self.nodes)
+
+    def intern(self, operation):
+        '''
+        Return the interned tree of an operation tree, the Operand returned
+        by Parser.parse. Nodes of the tree which have no interned equivalent
+        yet become interned themselves, unless their operands had to be
+        replaced, in which case a copy is interned. The tree is not
+        modified, but interned nodes are shared, so they must not be
+        modified either.
+        '''
+        results = []
+        for node in ep.walk_post_order(operation):
+            if isinstance(node, ep.InfixOperation):
+                second = results.pop()
+                first = results.pop()
+                results.append(self._intern_infix(node, first, second))
+            elif isinstance(node, ep.PostfixOperation):
+                results.append(self._intern_postfix(node, results.pop()))
+            elif node is None:
+                results.append(None)
+            else:
+                results.append(self._intern_node(_get_leaf_key(node), node))
+        return results.pop()
+
+    def _intern_infix(self, operation, first, second):
+        key = (type(operation), operation.operator, id(first), id(second))
+        try:
+            return self.nodes[key]
+        except KeyError:
+            pass
+        if first is not operation.first_operand or \
+            second is not operation.second_operand:
+                operation = ep._shallow_copy(operation)
+                operation.first_operand = first
+                operation.second_operand = second
+                operation.invalidate()
+        return self._intern_node(key, operation)
+
+    def _intern_postfix(self, operation, operand):
+        key = (type(operation), operation.operator, id(operand))
+        try:
+            return self.nodes[key]
+        except KeyError:
+            pass
+        if operand is not operation.operand:
+            operation = ep._shallow_copy(operation)
+            operation.operand = operand
+            operation.invalidate()
+        return self._intern_node(key, operation)
+
+    def _intern_node(self, key, node):
+        # The keys of operations hold the ids of their operands, which stay
+        # valid since an interned operation keeps its operands alive.
+        return self.nodes.setdefault(key, node)
+
+
+def evaluate(operation):
+    '''
+    Evaluates an interned tree, computing every distinct node at most once.
+    Nodes which do not depend on variables keep their value between
+    evaluations, like Operation.get_value does.
+
+    Raises the same errors as Operation.get_value, except that a missing
+    operand always raises MathSyntaxError.
+    '''
+    values = {}
+
+    def is_known(operation):
+        # The operands of operations whose value is known are not visited.
+        return id(operation) in values or _has_current_value(operation)
+
+    for node in ep.walk_post_order(operation, is_known):
+        if node is None:
+            raise ep.MathSyntaxError
+        if id(node) in values:
+            continue
+        if not isinstance(node, ep.Operation):
+            values[id(node)] = (node.get_value(), node.is_volatile())
+        elif _has_current_value(node):
+            values[id(node)] = (node.value, False)
+        else:
+            function = node.operator.get_function()
+            if isinstance(node, ep.InfixOperation):
+                first, first_volatile = values[id(node.first_operand)]
+                second, second_volatile = values[id(node.second_operand)]
+                value = function(first, second)
+                volatile = first_volatile or second_volatile
+            else:
+                operand, volatile = values[id(node.operand)]
+                value = function(operand)
+            _set_value(node, value, volatile)
+            values[id(node)] = (value, volatile)
+    return values[id(operation)][0]
+
+
+def _get_leaf_key(node):
+    if isinstance(node, ep.Variable):
+        return (ep.Variable, node.key, id(node.scope))
+    value = node.get_value()
+    key = (type(node), getattr(node, 'key', None), type(value), value)
+    if type(value) is float:
+        # 0.0 and -0.0 are equal but print differently.
+        key += (math.copysign(1.0, value),)
+    return key
+
+
+def _has_current_value(operation):
+    return not operation.dirty and not operation.volatile and \
+        operation.generation == tc.TrigConfigurator.generation
+
+
+def _set_value(operation, value, volatile):
+    # Records the value as Operation.get_value would have.
+    operation.value = value
+    operation.volatile = volatile
+    operation.dirty = False
+    operation.generation = tc.TrigConfigurator.generation
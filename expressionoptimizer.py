@@ -0,0 +1,172 @@
+# Simplifies parsed Operation trees before they are evaluated repeatedly, as
+# an expression with variables is, by folding constant subtrees, removing
+# identity operations and applying the degree to radian conversion once.
+import expressionparser as ep
+import mathbackends as mb
+import trigconfig as tc
+
+# Literals for which first <symbol> literal is first itself. They are ints
+# so that the type of a float operand is not changed by the rewrite. Adding 0
+# turns -0.0 into 0.0, the only value the rewrite changes. Dividing by 1 is
+# not an identity, since it turns an int into a float, or raises
+# OverflowError for an int too large for one.
+RIGHT_IDENTITIES = {
+    '+': 0,
+    '-': 0,
+    '*': 1,
+    '^': 1
+}
+LEFT_IDENTITIES = {
+    '+': 0,
+    '*': 1
+}
+
+_MULTIPLY = ep.Operator('*', ep.Parser.INFIX_OPERATORS['*']['func'],
+    ep.Parser.INFIX_OPERATORS['*']['prec'])
+
+def optimize(operation):
+    '''
+    Return an OptimizedExpression evaluating the same value as an operation
+    tree. The tree is not modified.
+
+    In degree mode, a function taking an angle is replaced by the radian
+    function of its argument multiplied by pi/180, and one returning an
+    angle by the radian function with its result multiplied by 180/pi, so
+    the optimized tree no longer depends on the angle mode it was parsed in. It can be evaluated
+    with get_value or compile_operation, but must not be converted with
+    RPNExpression.from_operation, which binds functions again by name.
+
+    operation: the Operand returned by Parser.parse, or None
+    '''
+    return OptimizedExpression(operation, _Optimizer().optimize(operation))
+
+
+class OptimizedExpression:
+    def __init__(self, original, optimized):
+        '''
+        Initializes an OptimizedExpression object.
+
+        original: the operation tree as parsed, used for display
+        optimized: the simplified tree used for evaluation
+        '''
+        self.original = original
+        self.optimized = optimized
+
+    def get_original(self):
+        return self.original
+
+    def get_optimized(self):
+        return self.optimized
+
+    def get_value(self):
+        if self.optimized is None:
+            raise ep.MathSyntaxError
+        return self.optimized.get_value()
+
+    def is_volatile(self):
+        return self.optimized is not None and self.optimized.is_volatile()
+
+    def get_unicode_string(self):
+        if self.original is None:
+            return str(self)
+        return self.original.get_unicode_string()
+
+    def __str__(self):
+        return str(self.original)
+
+
+class _Optimizer:
+    def optimize(self, operation):
+        results = []
+        for node in ep.walk_post_order(operation):
+            if isinstance(node, ep.InfixOperation):
+                second = results.pop()
+                first = results.pop()
+                results.append(self._optimize_infix(node, first, second))
+            elif isinstance(node, ep.PostfixOperation):
+                results.append(self._optimize_postfix(node, results.pop()))
+            elif isinstance(node, ep.Constant):
+                results.append(ep.Operand(node.get_value()))
+            else:
+                results.append(node)
+        return results.pop()
+
+    def _optimize_infix(self, operation, first, second):
+        symbol = operation.operator.symbol
+        if _is_default_infix(operation.operator) and first is not None \
+            and second is not None:
+            if symbol in RIGHT_IDENTITIES and \
+                _is_literal_int(second, RIGHT_IDENTITIES[symbol]):
+                    return first
+            if symbol in LEFT_IDENTITIES and \
+                _is_literal_int(first, LEFT_IDENTITIES[symbol]):
+                    return second
+        optimized = ep.InfixOperation(operation.operator, first)
+        optimized.set_second_operand(second)
+        return _fold(optimized, first, second)
+
+    def _optimize_postfix(self, operation, operand):
+        operator = operation.operator
+        if not isinstance(operation, ep.Function):
+            return _fold(ep.PostfixOperation(operator, operand), operand)
+
+        if operator.function is ep._negate and \
+            isinstance(operand, ep.Function) and \
+            operand.operator.function is ep._negate and \
+            operand.operand is not None:
+                return operand.operand
+
+        function = operator.get_function()
+        in_degrees = isinstance(function, tc.AngleFunction) and \
+            function.config.use_degrees
+        if in_degrees:
+            operator = ep.Operator(operator.symbol, function.function,
+                operator.precedence)
+            if function.kind == mb.ANGLE_ARGUMENT and operand is not None:
+                operand = _multiply(operand,
+                    function.config.backend.radians(1))
+
+        optimized = ep.Function(operator)
+        if operand is not None:
+            optimized.insert_operand(operand)
+        optimized = _fold(optimized, operand)
+        if in_degrees and function.kind == mb.ANGLE_RESULT:
+            optimized = _multiply(optimized, function.config.backend.degrees(1))
+        return optimized
+
+
+def _fold(operation, *operands):
+    # Replaces an operation on literals by its value. An operation which
+    # raises is kept so that the error is raised again on evaluation.
+    if not all(_is_literal(operand) for operand in operands):
+        return operation
+    try:
+        return ep.Operand(operation.get_value())
+    except Exception:
+        return operation
+
+
+def _multiply(operand, factor):
+    # The backends convert angles by multiplying by radians(1) or
+    # degrees(1), so multiplying by them gives the same results.
+    product = ep.InfixOperation(_MULTIPLY, operand)
+    product.set_second_operand(ep.Operand(factor))
+    return _fold(product, operand)
+
+
+def _is_default_infix(operator):
+    default = ep.Parser.INFIX_OPERATORS.get(operator.symbol)
+    return default is not None and operator.function is default['func']
+
+
+def _is_literal(operand):
+    # Whether the operand is a number which never changes.
+    return operand is not None and not isinstance(operand, ep.Operation) \
+        and not operand.is_volatile()
+
+
+def _is_literal_int(operand, value):
+    if not _is_literal(operand):
+        return False
+    number = operand.get_value()
+    return type(number) is int and number == value
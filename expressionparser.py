@@ -1,4 +1,10 @@
+import bisect
+import itertools
 import math
+from collections import OrderedDict, namedtuple
+import costmodel as cm
+import expressiontokenizer as et
+import mathbackends as mb
 import trigconfig as tc
 
 class Parser:
@@ -7,74 +13,169 @@ class Parser:
         '-': {'prec': 0, 'func': lambda a, b: a - b},
         '*': {'prec': 1, 'func': lambda a, b: a * b},
         '/': {'prec': 1, 'func': lambda a, b: a / b},
-        '^': {'prec': 2, 'func': lambda a, b: a ** b}
+        '^': {'prec': 2, 'func': cm.cost_model.power}
     }
     POSTFIX_OPERATORS = {
-        '!': {'prec': 3, 'func': math.factorial}
+        '!': {'prec': 3, 'func': cm.cost_model.factorial}
     }
     FUNCTION_PRECEDENCE = 1000
 
-    def __init__(self, use_degrees=False):
-        self.trig_config = tc.TrigConfigurator(use_degrees)
-        self.functions = {
-            'sin': self.trig_config.sin,
-            'cos': self.trig_config.cos,
-            'tan': self.trig_config.tan
+    def __init__(self, use_degrees=False, variables=(), cache_size=0,
+        backend=None):
+        '''
+        Initializes a Parser object.
+
+        use_degrees: whether trigonometric functions take their arguments in
+            degrees rather than radians
+        variables: names which are parsed as free variables. Their values are
+            assigned with set_variable before evaluation.
+        cache_size: the number of parsed expressions kept in the parse cache.
+            0 disables the cache.
+        backend: the MathBackend providing the functions, constants and
+            numbers of the expressions. Defaults to the math module.
+        '''
+        self.backend = backend or mb.MATH_BACKEND
+        self.make_float = self.backend.make_float
+        # Each angle mode has its own TrigConfigurator whose mode never
+        # changes, so a parsed tree keeps the mode it was parsed in and can be
+        # cached and reused safely.
+        self.trig_configs = {
+            False: tc.TrigConfigurator(False, self.backend),
+            True: tc.TrigConfigurator(True, self.backend)
         }
+        self.variable_names = frozenset(variables)
+        self.variable_values = {}
+        self.cache = ParseCache(cache_size)
+        # Operators are immutable, so every operation with the same operator
+        # shares a single Operator object.
+        operators = self.backend.operators
+        self.infix_operators = {symbol: Operator(symbol, 
+            operators.get(symbol, spec['func']), spec['prec'])
+            for symbol, spec in Parser.INFIX_OPERATORS.items()}
+        self.postfix_operators = {symbol: Operator(symbol,
+            operators.get(symbol, spec['func']), spec['prec'])
+            for symbol, spec in Parser.POSTFIX_OPERATORS.items()}
+        self.negation_operator = Operator('-', _negate, Parser.FUNCTION_PRECEDENCE)
+        self.tokenizer = et.Tokenizer(list(Parser.INFIX_OPERATORS) + 
+            list(Parser.POSTFIX_OPERATORS))
+        self.set_use_degrees(use_degrees)
 
     def parse(self, expression):
         '''
         Parses a valid mathematical expression into an Operation object for
         evaluation.
 
+        When the parse cache is enabled, the same tree is returned for every
+        parse of an expression in the same angle mode, so the returned trees
+        must not be modified.
+
         expression: string containing a valid mathematical expression using
             infix notation
         '''
-        self.current_item = None
+        if not self.cache.maxsize:
+            return self._parse(expression)
+
+        expression = _normalize(expression)
+        key = (expression, self.trig_config.use_degrees)
+        try:
+            return self.cache.get(key)
+        except KeyError:
+            operation = self._parse(expression)
+            self.cache.put(key, operation)
+            return operation
+
+    def parse_file(self, file):
+        '''
+        Parses an expression read from a file-like object opened in text
+        mode. The file is tokenized as it is read, so the expression is never
+        held in memory as a whole. The parse cache is not used.
+        '''
+        self._reset_state()
+        self._insert_tokens(self.tokenizer.tokenize_file(file))
+        return self._finish_parse()
+
+    def get_cache_info(self):
+        return self.cache.get_info()
 
+    def set_use_degrees(self, use_degrees):
+        self.trig_config = self.trig_configs[use_degrees]
+        self.functions = {name: self.trig_config.make_function(name)
+            for name in mb.FUNCTIONS}
+        self.function_operators = {symbol: Operator(symbol, function, 
+            Parser.FUNCTION_PRECEDENCE) for symbol, function in self.functions.items()}
+
+    def set_variable(self, name, value):
+        '''
+        Assigns a value to a free variable of the expressions parsed by this
+        parser.
+        '''
+        if name not in self.variable_names:
+            raise KeyError(name)
+        self.variable_values[name] = value
+
+    def _parse(self, expression):
+        self._reset_state()
+        self._insert_tokens(self.tokenizer.tokenize(expression))
+        return self._finish_parse()
+
+    def _reset_state(self):
+        self.current_item = None
         self.parent_stack = []
-        self.number_buffer = []
-        self.letter_buffer = []
 
-        for char in expression:
-            self._insert_to_operation(char)
-        self._empty_buffers()
-        
+    def _finish_parse(self):
         while len(self.parent_stack):
             self._move_to_parent()
         
         return self.current_item
 
-    def set_use_degrees(self, use_degrees):
-        self.trig_config.set_mode(use_degrees)
-
-    def _empty_buffers(self):
-        self._empty_letter_buffer()
-        self._empty_number_buffer()      
-
-    def _empty_letter_buffer(self):
-        try:
-            string_rep = ''.join(self.letter_buffer)
-            if string_rep in self.functions:
-                self._insert_new_function(string_rep)
-            elif string_rep in Constant.VALUES:
-                operand = Constant(string_rep)
-                self._insert_new_operand(operand)
-            self.letter_buffer = []
-        except TypeError:
-            pass
-
-    def _empty_number_buffer(self):
-        if len(self.number_buffer):
-            number = None
-            string_rep = ''.join(self.number_buffer)
-            if '.' in string_rep:
-                number = float(string_rep)
+    def _insert_tokens(self, tokens):
+        for token in tokens:
+            try:
+                self._insert_token(token)
+            except MathSyntaxError as error:
+                error.position = token.position
+                raise
+
+    def _insert_token(self, token):
+        kind = token.kind
+        if kind == et.NUMBER:
+            self._insert_new_number(token.text)
+        elif kind == et.NAME:
+            self._insert_new_name(token.text)
+        elif kind == et.OPERATOR:
+            symbol = token.text
+            if self._is_postfix_operator(symbol):
+                self._insert_new_postfix_operation(symbol)
+            elif self.current_item:
+                self._insert_new_infix_operation(symbol)
+            elif symbol == '-':
+                self.parent_stack.append(Function(self.negation_operator))
             else:
-                number = int(string_rep)
-            operand = Operand(number)
-            self._insert_new_operand(operand)
-            self.number_buffer = []
+                raise MathSyntaxError
+        elif token.text == '(':
+            self.parent_stack.append(self.current_item)
+            self.current_item = None
+        else:
+            try:
+                self._move_to_parent()
+            except ParentNotFoundError:
+                raise MathSyntaxError
+
+    def _insert_new_name(self, name):
+        # Names which are not functions, constants or variables are ignored.
+        if name in self.functions:
+            self._insert_new_function(name)
+        elif name in self.backend.constants:
+            self._insert_new_operand(Constant(name, self.backend.constants[name]))
+        elif name in self.variable_names:
+            self._insert_new_operand(Variable(name, self.variable_values))
+
+    def _insert_new_number(self, string_rep):
+        if '.' in string_rep:
+            number = self.make_float(string_rep)
+        else:
+            number = int(string_rep)
+        self._insert_new_operand(Operand(number))
 
     def _insert_new_function(self, function):
         if self.current_item:
@@ -100,33 +201,25 @@ class Parser:
         self.current_item = new_operation
 
     def _insert_new_operand(self, operand):
+        if self.current_item is None:
+            self.current_item = operand
+            return
         try:
             self.current_item.insert_operand(operand)
         except AttributeError:  
-            if not self.current_item:
-                self.current_item = operand
-            else:
-                raise MathSyntaxError
+            raise MathSyntaxError
 
-    def _is_infix_operator(self, char):
-        return char in Parser.INFIX_OPERATORS
-    
-    def _is_postfix_operator(self, char):
-        return char in Parser.POSTFIX_OPERATORS
+    def _is_postfix_operator(self, symbol):
+        return symbol in Parser.POSTFIX_OPERATORS
 
     def _make_postfix_operator(self, symbol):
-        function = Parser.POSTFIX_OPERATORS[symbol]['func']
-        precedence = Parser.POSTFIX_OPERATORS[symbol]['prec']
-        return Operator(symbol, function, precedence)
+        return self.postfix_operators[symbol]
 
     def _make_infix_operator(self, symbol):
-        function = Parser.INFIX_OPERATORS[symbol]['func']
-        precedence = Parser.INFIX_OPERATORS[symbol]['prec']
-        return Operator(symbol, function, precedence)
+        return self.infix_operators[symbol]
 
     def _make_function(self, symbol):
-        function = self.functions[symbol]
-        return Operator(symbol, function, Parser.FUNCTION_PRECEDENCE)
+        return self.function_operators[symbol]
 
     def _move_to_parent(self):
         current_operation = self.current_item
@@ -149,45 +242,237 @@ class Parser:
         string = '[%s]' % ', '.join([str(item) for item in self.parent_stack])
         print(string)
 
-    def _insert_to_operation(self, char):
-        if char.isalpha():
-            self._empty_number_buffer()
-            self.letter_buffer.append(char)
-        elif char.isdecimal() or char == '.':
-            self._empty_letter_buffer()
-            self.number_buffer.append(char)
-        elif self._is_infix_operator(char):
-            self._empty_buffers()
-            if not self.current_item:
-                if char == '-':
-                    new_operator = Operator('-', lambda a: -1*a, Parser.FUNCTION_PRECEDENCE)
-                    self.parent_stack.append(Function(new_operator))
-                else:
-                    raise MathSyntaxError
-            else:
-                self._insert_new_infix_operation(char)
-        elif self._is_postfix_operator(char):
-            self._empty_buffers()
-            self._insert_new_postfix_operation(char)
-        elif char == '(':
-            self._empty_buffers()
-            self.parent_stack.append(self.current_item)
-            self.current_item = None
-        elif char == ')':
-            self._empty_buffers()
+
+class IncrementalParser(Parser):
+    '''
+    Parser which reuses the work done on the previously parsed expression.
+
+    The parser state is recorded at every token boundary. When the next
+    expression shares a prefix with the previous one, as it does after a
+    character is typed or removed with backspace, parsing resumes from the
+    last state recorded inside that prefix so only the changed tail is
+    processed.
+    '''
+    def set_use_degrees(self, use_degrees):
+        # The snapshots hold functions bound to the previous angle mode.
+        Parser.set_use_degrees(self, use_degrees)
+        self._reset_snapshots()
+
+    def _parse(self, expression):
+        start = self._restore_snapshot(expression)
+        self.expression = expression
+
+        for token in self.tokenizer.tokenize(expression, start):
             try:
-                self._move_to_parent()
-            except ParentNotFoundError:
-                raise MathSyntaxError
+                self._insert_token(token)
+            except MathSyntaxError as error:
+                error.position = token.position
+                raise
+            # Numbers and names may continue in the next expression, so
+            # the state is only recorded after operators and parentheses.
+            if token.kind == et.OPERATOR or token.kind == et.PAREN:
+                self._take_snapshot(token.position + 1)
+
+        return self._finish_parse()
+
+    def _reset_snapshots(self):
+        self.expression = ''
+        self.snapshot_positions = [0]
+        self.snapshots = [((None, 0), None)]
+
+    def _restore_snapshot(self, expression):
+        prefix_length = _common_prefix_length(self.expression, expression)
+        index = bisect.bisect_right(self.snapshot_positions, prefix_length) - 1
+        del self.snapshot_positions[index + 1:]
+        del self.snapshots[index + 1:]
+
+        parent_stack, current_item = self.snapshots[index]
+        self._reset_state()
+        self.parent_stack = _ParentStack(*parent_stack)
+        self.current_item = _shallow_copy(current_item)
+        return self.snapshot_positions[index]
+
+    def _take_snapshot(self, position):
+        # The parent stack is recorded by its top, which is shared with the
+        # current stack, so a snapshot takes constant time and memory however
+        # deeply the expression is nested.
+        if position > self.snapshot_positions[-1]:
+            self.snapshot_positions.append(position)
+            self.snapshots.append(((self.parent_stack.top,
+                self.parent_stack.size), _shallow_copy(self.current_item)))
+
+    def _move_to_parent(self):
+        # Operations on the parent stack are shared with the snapshots, so
+        # they are copied before they receive an operand.
+        current_operation = self.current_item
+        try:
+            parent = self.parent_stack.pop()
+        except IndexError:
+            raise ParentNotFoundError
+        else:
+            self.current_item = _shallow_copy(parent)
+            self._insert_new_operand(current_operation)
+
+
+class ParseCache:
+    '''
+    Bounded mapping from expressions to parsed trees which discards the least
+    recently used tree when it is full.
+    '''
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            operation = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return operation
+
+    def get_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self.entries))
+
+    def put(self, key, operation):
+        self.entries[key] = operation
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize')
+
+
+def walk_post_order(operation, skip=None):
+    '''
+    Generate the nodes of an operation tree in post-order: the operands of
+    each operation, from first to last, then the operation. A missing
+    operand is generated as None. The tree is walked with an explicit stack
+    rather than recursion, so deeply nested expressions do not hit the
+    recursion limit.
+
+    operation: the Operand returned by Parser.parse
+    skip: function called with each operation when it is reached, before
+        its operands, returning whether the operation is generated without
+        them. It sees the work done on the nodes generated before, so it can
+        skip the subtrees shared with them.
+    '''
+    stack = [(operation, False)]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        node, operands_done = pop()
+        if operands_done or not isinstance(node, Operation) or \
+            (skip and skip(node)):
+                yield node
+        elif isinstance(node, InfixOperation):
+            push((node, True))
+            push((node.second_operand, False))
+            push((node.first_operand, False))
+        else:
+            push((node, True))
+            push((node.operand, False))
+
+
+def _normalize(expression):
+    # Whitespace never changes how an expression is parsed.
+    return ''.join(expression.split())
+
+
+def _negate(a):
+    return -1*a
+
+
+class _ParentStack:
+    # Stack of the operations enclosing the current item of an
+    # IncrementalParser, with the list methods used by Parser. Items are held
+    # in (item, below) pairs which are never modified, so the stack can be
+    # recorded and restored from its top while it keeps changing.
+    __slots__ = ('top', 'size')
+
+    def __init__(self, top=None, size=0):
+        self.top = top
+        self.size = size
+
+    def append(self, item):
+        self.top = (item, self.top)
+        self.size += 1
+
+    def pop(self):
+        if self.top is None:
+            raise IndexError
+        item, self.top = self.top
+        self.size -= 1
+        return item
+
+    def __getitem__(self, index):
+        if index != -1 or self.top is None:
+            raise IndexError
+        return self.top[0]
+
+    def __iter__(self):
+        items = []
+        node = self.top
+        while node is not None:
+            items.append(node[0])
+            node = node[1]
+        return reversed(items)
+
+    def __len__(self):
+        return self.size
+
+
+def _shallow_copy(operand):
+    if operand is None:
+        return None
+    duplicate = object.__new__(type(operand))
+    duplicate.__dict__.update(operand.__dict__)
+    return duplicate
+
+
+def _common_prefix_length(first, second):
+    if second.startswith(first):
+        return len(first)
+    if first.startswith(second):
+        return len(second)
+    length = 0
+    for first_char, second_char in zip(first, second):
+        if first_char != second_char:
+            break
+        length += 1
+    return length
 
        
 class Operand(object):
+    # Whether the value can change without the operand being modified, in
+    # which case it must not be cached by its parents. Operands whose
+    # get_value does not simply return value must be volatile, since the
+    # value of the others is read directly during evaluation.
+    volatile = False
+
     def __init__(self, value):
         self.value = value
 
     def get_value(self):
         return self.value
 
+    def is_volatile(self):
+        return self.volatile
+
+    def get_unicode_string(self):
+        return str(self)
+
     def __str__(self):
         return str(self.value)
 
@@ -198,12 +483,18 @@ class Constant(Operand):
     }
 
     UNICODE_SYMBOLS = {
-        'pi': '\ucf80',
+        'pi': '\u03c0',
         'e': '\U0001D452'
     }
 
-    def __init__(self, key):
-        Operand.__init__(self, Constant.VALUES[key])
+    def __init__(self, key, value=None):
+        '''
+        Initializes a Constant object.
+
+        key: the name of the constant
+        value: its value, by default the float from VALUES
+        '''
+        Operand.__init__(self, Constant.VALUES[key] if value is None else value)
         self.key = key
 
     def __str__(self):
@@ -212,18 +503,95 @@ class Constant(Operand):
     def get_unicode_exp(self):
         return Constant.UNICODE_SYMBOLS[self.key]
 
+    def get_unicode_string(self):
+        return self.get_unicode_exp()
+
+class Variable(Operand):
+    volatile = True
+
+    def __init__(self, key, scope):
+        '''
+        Initializes a Variable object.
+
+        key: the name of the variable
+        scope: a dict mapping variable names to their current values
+        '''
+        Operand.__init__(self, None)
+        self.key = key
+        self.scope = scope
+
+    def get_value(self):
+        try:
+            return self.scope[self.key]
+        except KeyError:
+            raise MathSyntaxError
+
+    def __str__(self):
+        return self.key
+
 class Operation(Operand):
+    # The depth up to which trees are evaluated and written with recursion,
+    # which is faster for typical expressions. Deeper subtrees are handled
+    # with an explicit stack, so nesting is limited only by memory.
+    MAX_RECURSION_DEPTH = 100
+    # The longest string cached for an operation which is written as part
+    # of a larger one. Caching longer ones would keep, or with the explicit
+    # stack copy, the string of a deep tree once for each level.
+    MAX_SHARED_STRING_LENGTH = 256
+
     def __init__(self, operator):
         Operand.__init__(self, None)
         self.operator = operator
+        self.dirty = True
+        self.volatile = False
+        self.generation = None
+        # The evaluation pass which last computed the value, so that an
+        # operation shared by several operands is computed once in a pass.
+        self.evaluation = None
+        # Cached ASCII and unicode strings, or None until rendered.
+        self.string = None
+        self.unicode_string = None
 
     def get_precedence(self):
         return self.operator.get_precedence()
 
     def get_value(self):
-        self._evaluate()
+        '''
+        Return the value of the operation. The value is cached until an
+        operand is inserted, the angle mode changes or invalidate is called,
+        except for operations depending on variables, which are always
+        re-evaluated.
+
+        Subtrees deeper than MAX_RECURSION_DEPTH are traversed with an
+        explicit stack rather than recursion, so the depth of the tree is
+        limited only by memory. Operations are evaluated in the same order,
+        and raise the same errors, as if each evaluated its operands from
+        left to right, except that a missing operand always raises
+        MathSyntaxError. An operation shared by several operands, as in an
+        interned tree, is evaluated once.
+        '''
+        generation = tc.TrigConfigurator.generation
+        if self.dirty or self.volatile or self.generation != generation:
+            self._evaluate(generation, next(_evaluations),
+                Operation.MAX_RECURSION_DEPTH)
         return self.value
 
+    def get_unicode_string(self):
+        '''
+        Return the string of the operation with the unicode symbols of its
+        constants and operators, as in 2\u00d7\u03c0 for 2*pi.
+        '''
+        return self._render(True)
+
+    def invalidate(self):
+        '''
+        Discard the cached value and strings. Needed after modifying an
+        operand which is already nested inside this operation.
+        '''
+        self.dirty = True
+        self.string = None
+        self.unicode_string = None
+
     def get_last_operand(self):
         raise NotImplementedError
 
@@ -233,9 +601,114 @@ class Operation(Operand):
     def insert_operand(self, operand):
         raise NotImplementedError
 
-    def _evaluate(self):
+    def _compute(self, generation, evaluation):
+        # Evaluates the operation from the values of its operands, which are
+        # current, and caches the value.
+        raise NotImplementedError
+
+    def _evaluate(self, generation, evaluation, depth):
+        # Evaluates the operands which are not current, recursively up to
+        # depth levels, then the operation.
+        raise NotImplementedError
+
+    def _evaluate_iteratively(self, generation, evaluation):
+        # Lists the operations to evaluate in pre-order, visiting the last
+        # operand of each first, so that in reverse every operation comes
+        # after its operands and after the operations on its left.
+        stale = []
+        stack = [self]
+        pop = stack.pop
+        append = stale.append
+        while stack:
+            operation = pop()
+            append(operation)
+            operation._push_stale_operands(stack, generation, evaluation)
+        # An operation is listed under each operation using it. Its last
+        # listing comes after all of them, so the others are dropped.
+        for operation in dict.fromkeys(reversed(stale)):
+            operation._compute(generation, evaluation)
+
+    def _push_parts(self, stack, unicode):
+        # Pushes the parts of the string of the operation in reverse order:
+        # strings, and operands whose string is written in their place.
+        raise NotImplementedError
+
+    def _push_stale_operands(self, stack, generation, evaluation):
+        # Pushes the operands which are operations without a current value,
+        # from first to last, and an _OperandCheck for each other operand
+        # which must be evaluated before them.
         raise NotImplementedError
 
+    def _render(self, unicode):
+        # Operations with a cached string are written with it, so that
+        # subtrees shared with previously rendered trees, such as the
+        # snapshots of an IncrementalParser or interned nodes, are not
+        # traversed again.
+        if unicode:
+            string = self.unicode_string
+            if string is None:
+                string = self._write(True, Operation.MAX_RECURSION_DEPTH)
+                self.unicode_string = string
+        else:
+            string = self.string
+            if string is None:
+                string = self._write(False, Operation.MAX_RECURSION_DEPTH)
+                self.string = string
+        return string
+
+    def _write(self, unicode, depth):
+        # Returns the string of the operation, writing its operands
+        # recursively up to depth levels. Strings up to
+        # MAX_SHARED_STRING_LENGTH are cached, since writing builds the
+        # string of every operation anyway.
+        raise NotImplementedError
+
+    def _write_iteratively(self, unicode):
+        # Collects the parts of the string in order with an explicit stack
+        # and joins them once, instead of building and copying a string for
+        # each subtree. The strings of the operations below
+        # MAX_SHARED_STRING_LENGTH are cached on the way.
+        name = 'unicode_string' if unicode else 'string'
+        max_length = Operation.MAX_SHARED_STRING_LENGTH
+        parts = []
+        append = parts.append
+        length = 0
+        stack = [self]
+        pop = stack.pop
+        while stack:
+            part = pop()
+            if type(part) is str:
+                pass
+            elif isinstance(part, Operation):
+                string = getattr(part, name)
+                if string is None:
+                    # Marks where the parts of the operation end, with the
+                    # number of parts and their length before them.
+                    stack.append((part, len(parts), length))
+                    part._push_parts(stack, unicode)
+                    continue
+                part = string
+            elif type(part) is tuple:
+                operation, start, start_length = part
+                if length - start_length <= max_length:
+                    string = ''.join(parts[start:])
+                    del parts[start:]
+                    append(string)
+                    setattr(operation, name, string)
+                continue
+            elif unicode and part is not None:
+                part = part.get_unicode_string()
+            else:
+                part = str(part)
+            append(part)
+            length += len(part)
+        string = ''.join(parts)
+        setattr(self, name, string)
+        return string
+
+    def __str__(self):
+        return self._render(False)
+
 
 class InfixOperation(Operation):
     def __init__(self, operator, first_operand):
@@ -256,37 +729,113 @@ class InfixOperation(Operation):
             self.second_operand = operand
         else:
             raise UnexpectedOperandError
+        self.invalidate()
 
     def set_second_operand(self, operand):
         self.second_operand = operand
+        self.invalidate()
 
-    def _evaluate(self):
+    def _compute(self, generation, evaluation):
+        first = self.first_operand
+        second = self.second_operand
         try:
-            first_operand_val = self.first_operand.get_value()
-            second_operand_val = self.second_operand.get_value()
+            if first.volatile and not isinstance(first, Operation):
+                first_operand_val = first.get_value()
+            else:
+                first_operand_val = first.value
+            if second.volatile and not isinstance(second, Operation):
+                second_operand_val = second.get_value()
+            else:
+                second_operand_val = second.value
         except AttributeError:
             raise MathSyntaxError
+        self.generation = generation
+        self.evaluation = evaluation
+        self.value = self.operator.function(first_operand_val,
+            second_operand_val)
+        self.volatile = first.volatile or second.volatile
+        self.dirty = False
+
+    def _evaluate(self, generation, evaluation, depth):
+        if not depth:
+            return self._evaluate_iteratively(generation, evaluation)
+        first = self.first_operand
+        if isinstance(first, Operation):
+            if first.dirty or first.generation != generation or \
+                first.volatile and first.evaluation != evaluation:
+                    first._evaluate(generation, evaluation, depth - 1)
+        elif first is None:
+            raise MathSyntaxError
+        elif first.volatile:
+            # Raises the error of the first operand before those of the
+            # second, as _push_stale_operands does.
+            first.get_value()
+        second = self.second_operand
+        if isinstance(second, Operation) and (second.dirty or
+            second.generation != generation or
+            second.volatile and second.evaluation != evaluation):
+                second._evaluate(generation, evaluation, depth - 1)
+        self._compute(generation, evaluation)
+
+    def _push_parts(self, stack, unicode):
+        first = self.first_operand
+        second = self.second_operand
+        operator = self.operator
+        precedence = operator.precedence
+        if isinstance(second, Operation) and \
+            precedence > second.operator.precedence:
+                stack.extend((')', second, '('))
         else:
-            function = self.operator.get_function()
-            self.value = function(first_operand_val, second_operand_val)
-
-    def __str__(self):
-        string_rep = ''
-        if isinstance(self.first_operand, Operation) and \
-            self.get_precedence() > self.first_operand.get_precedence():
-                string_rep += '(%s)' % str(self.first_operand)
+            stack.append(second)
+        stack.append(operator.unicode_symbol if unicode else operator.symbol)
+        if isinstance(first, Operation) and \
+            precedence > first.operator.precedence:
+                stack.extend((')', first, '('))
         else:
-            string_rep += str(self.first_operand)
-
-        string_rep += str(self.operator)
-
-        if isinstance(self.second_operand, Operation) and \
-            self.get_precedence() > self.second_operand.get_precedence():
-                string_rep += '(%s)' % str(self.second_operand)
+            stack.append(first)
+
+    def _push_stale_operands(self, stack, generation, evaluation):
+        first = self.first_operand
+        if isinstance(first, Operation):
+            if first.dirty or first.generation != generation or \
+                first.volatile and first.evaluation != evaluation:
+                    stack.append(first)
+        elif first is None or first.volatile:
+            # The first operand is evaluated with the operation, after the
+            # second. If both can fail, the error of the first must be
+            # raised, so it is also evaluated before the second.
+            stack.append(_OperandCheck(first))
+        second = self.second_operand
+        if isinstance(second, Operation) and (second.dirty or
+            second.generation != generation or
+            second.volatile and second.evaluation != evaluation):
+                stack.append(second)
+
+    def _write(self, unicode, depth):
+        if not depth:
+            return self._write_iteratively(unicode)
+        first = self.first_operand
+        second = self.second_operand
+        operator = self.operator
+        precedence = operator.precedence
+        first_string = _write_operand(first, unicode, depth - 1)
+        if isinstance(first, Operation) and \
+            precedence > first.operator.precedence:
+                first_string = '(' + first_string + ')'
+        second_string = _write_operand(second, unicode, depth - 1)
+        if isinstance(second, Operation) and \
+            precedence > second.operator.precedence:
+                second_string = '(' + second_string + ')'
+        if unicode:
+            string = first_string + operator.unicode_symbol + second_string
+            if len(string) <= Operation.MAX_SHARED_STRING_LENGTH:
+                self.unicode_string = string
         else:
-            string_rep += str(self.second_operand)
+            string = first_string + operator.symbol + second_string
+            if len(string) <= Operation.MAX_SHARED_STRING_LENGTH:
+                self.string = string
+        return string
 
-        return string_rep            
     
 class PostfixOperation(Operation):
     def __init__(self, operator, operand=None):
@@ -296,41 +845,147 @@ class PostfixOperation(Operation):
     def get_last_operand(self):
         return self.operand
 
-    def get_unicode_string(self):
-        return str(self)
-
     def insert_operand(self, operand):
         if not self.operand:
             self.operand = operand
         else:
             raise UnexpectedOperandError
+        self.invalidate()
 
-    def _evaluate(self):
-        operand_val = self.operand.get_value()
-        function = self.operator.get_function()
-        self.value = function(operand_val)
-
-    def __str__(self):
-        if isinstance(self.operand, Operation) and \
-            self.get_precedence() > self.operand.get_precedence():
-                return '(%s)%s' % (str(self.operand), str(self.operator))
+    def _compute(self, generation, evaluation):
+        operand = self.operand
+        try:
+            if operand.volatile and not isinstance(operand, Operation):
+                operand_val = operand.get_value()
+            else:
+                operand_val = operand.value
+        except AttributeError:
+            raise MathSyntaxError
+        self.generation = generation
+        self.evaluation = evaluation
+        self.value = self.operator.function(operand_val)
+        self.volatile = operand.volatile
+        self.dirty = False
+
+    def _evaluate(self, generation, evaluation, depth):
+        if not depth:
+            return self._evaluate_iteratively(generation, evaluation)
+        operand = self.operand
+        if isinstance(operand, Operation) and (operand.dirty or
+            operand.generation != generation or
+            operand.volatile and operand.evaluation != evaluation):
+                operand._evaluate(generation, evaluation, depth - 1)
+        self._compute(generation, evaluation)
+
+    def _push_parts(self, stack, unicode):
+        operand = self.operand
+        operator = self.operator
+        stack.append(operator.unicode_symbol if unicode else operator.symbol)
+        if isinstance(operand, Operation) and \
+            operator.precedence > operand.operator.precedence:
+                stack.extend((')', operand, '('))
+        else:
+            stack.append(operand)
+
+    def _push_stale_operands(self, stack, generation, evaluation):
+        operand = self.operand
+        if isinstance(operand, Operation) and (operand.dirty or
+            operand.generation != generation or
+            operand.volatile and operand.evaluation != evaluation):
+                stack.append(operand)
+
+    def _write(self, unicode, depth):
+        if not depth:
+            return self._write_iteratively(unicode)
+        operand = self.operand
+        operator = self.operator
+        operand_string = _write_operand(operand, unicode, depth - 1)
+        if isinstance(operand, Operation) and \
+            operator.precedence > operand.operator.precedence:
+                operand_string = '(' + operand_string + ')'
+        if unicode:
+            string = operand_string + operator.unicode_symbol
+            if len(string) <= Operation.MAX_SHARED_STRING_LENGTH:
+                self.unicode_string = string
         else:
-            return '%s%s' % (str(self.operand), str(self.operator))
+            string = operand_string + operator.symbol
+            if len(string) <= Operation.MAX_SHARED_STRING_LENGTH:
+                self.string = string
+        return string
 
 
 class Function(PostfixOperation):
     def __init__(self, operator):
         PostfixOperation.__init__(self, operator)
 
-    def __str__(self):
-        return '%s(%s)' % (str(self.operator), str(self.operand))
+    def _push_parts(self, stack, unicode):
+        operator = self.operator
+        stack.extend((')', self.operand, '(',
+            operator.unicode_symbol if unicode else operator.symbol))
+
+    def _write(self, unicode, depth):
+        if not depth:
+            return self._write_iteratively(unicode)
+        operand_string = _write_operand(self.operand, unicode, depth - 1)
+        if unicode:
+            string = self.operator.unicode_symbol + '(' + operand_string + ')'
+            if len(string) <= Operation.MAX_SHARED_STRING_LENGTH:
+                self.unicode_string = string
+        else:
+            string = self.operator.symbol + '(' + operand_string + ')'
+            if len(string) <= Operation.MAX_SHARED_STRING_LENGTH:
+                self.string = string
+        return string
+
+
+class _OperandCheck:
+    # Stands for an operand in the evaluation order of Operation.get_value,
+    # raising the error evaluating it would.
+    __slots__ = ('operand',)
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def _compute(self, generation, evaluation):
+        if self.operand is None:
+            raise MathSyntaxError
+        self.operand.get_value()
+
+    def _push_stale_operands(self, stack, generation, evaluation):
+        pass
+
+
+# Numbers the passes of Operation.get_value.
+_evaluations = itertools.count()
+
+
+def _write_operand(operand, unicode, depth):
+    # Returns the string of an operand written by Operation._write.
+    if isinstance(operand, Operation):
+        string = operand.unicode_string if unicode else operand.string
+        if string is None:
+            string = operand._write(unicode, depth)
+        return string
+    if unicode and operand is not None:
+        return operand.get_unicode_string()
+    return str(operand)
 
 
 class Operator:
+    __slots__ = ('symbol', 'function', 'precedence', 'unicode_symbol')
+
+    UNICODE_SYMBOLS = {
+        '-': '\u2212',
+        '*': '\u00d7',
+        '/': '\u00f7',
+        'sqrt': '\u221a'
+    }
+
     def __init__(self, symbol, function, precedence):
         self.symbol = symbol
         self.function = function
         self.precedence = precedence
+        self.unicode_symbol = Operator.UNICODE_SYMBOLS.get(symbol, symbol)
     
     def get_function(self):
         return self.function
@@ -343,7 +998,9 @@ class Operator:
 
 
 class MathSyntaxError(Exception):
-    pass
+    # Index in the expression of the token where the error was found, if
+    # known.
+    position = None
 
 
 class ParentNotFoundError(Exception):
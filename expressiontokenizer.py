@@ -0,0 +1,81 @@
+# Splits expressions into tokens with a single compiled regular expression.
+import re
+from collections import namedtuple
+
+NUMBER = 'number'
+NAME = 'name'
+OPERATOR = 'operator'
+PAREN = 'paren'
+
+Token = namedtuple('Token', 'kind text position')
+
+_KINDS = (None, NUMBER, NAME, OPERATOR, PAREN)
+_make_token = tuple.__new__
+
+class Tokenizer:
+    '''
+    Generates the tokens of an expression: numbers, names (runs of letters),
+    single-character operators and parentheses.
+
+    Any other character is skipped without ending the current token, so
+    '1 000' is the number 1000 and 's in' is the name sin.
+    '''
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, operator_symbols):
+        '''
+        Initializes a Tokenizer object.
+
+        operator_symbols: iterable of the single-character operators
+        '''
+        operators = ''.join(re.escape(symbol) for symbol in operator_symbols)
+        # The groups are in the order of _KINDS.
+        self.pattern = re.compile(
+            r'([\d.]+)|([^\W\d_]+)|([%s])|([()])' % operators)
+        self.skipped_pattern = re.compile(r'[^\w.()%s]|_' % operators)
+
+    def tokenize(self, expression, start=0):
+        '''
+        Generate the tokens of a string, starting at index start. Token
+        positions are indices into the string.
+        '''
+        if self.skipped_pattern.search(expression, start):
+            return _merge_split_tokens(self._match(expression, start))
+        else:
+            return self._match(expression, start)
+
+    def tokenize_file(self, file, chunk_size=CHUNK_SIZE):
+        '''
+        Generate the tokens of a file-like object opened in text mode,
+        reading it chunk_size characters at a time.
+        '''
+        return _merge_split_tokens(self._match_chunks(file, chunk_size))
+
+    def _match(self, expression, start, offset=0):
+        for match in self.pattern.finditer(expression, start):
+            yield _make_token(Token, (_KINDS[match.lastindex], match.group(),
+                match.start() + offset))
+
+    def _match_chunks(self, file, chunk_size):
+        offset = 0
+        chunk = file.read(chunk_size)
+        while chunk:
+            yield from self._match(chunk, 0, offset)
+            offset += len(chunk)
+            chunk = file.read(chunk_size)
+
+
+def _merge_split_tokens(tokens):
+    # Numbers and names separated only by skipped characters, or by the end
+    # of a chunk, are joined into a single token.
+    pending = None
+    for token in tokens:
+        if pending:
+            if token.kind == pending.kind and token.kind in (NUMBER, NAME):
+                pending = Token(pending.kind, pending.text + token.text,
+                    pending.position)
+                continue
+            yield pending
+        pending = token
+    if pending:
+        yield pending
@@ -0,0 +1,160 @@
+# Keeps the calculation history on disk as an append-only log so that it
+# survives restarts. Each entry is one line of UTF-8 text holding the input
+# and result strings separated by a tab. Only the end of the log is read on
+# startup, through a memory map, so the size of the log does not slow it down.
+# Older entries are read a page at a time when they are needed.
+import mmap
+import os
+import re
+import shutil
+
+class HistoryLog:
+    SYNC_BATCH = 8
+    MAX_BYTES = 1 << 20
+
+    def __init__(self, path, keep, sync_batch=SYNC_BATCH, max_bytes=MAX_BYTES):
+        '''
+        Initializes a HistoryLog object, creating the log file if needed.
+
+        path: the path of the log file
+        keep: the number of newest entries kept when the log is compacted
+        sync_batch: the number of appended entries after which the log is
+            synced to disk. Entries are flushed to the operating system on
+            every append, so only a system crash can lose the unsynced ones.
+        max_bytes: the size of the log above which it is first compacted
+        '''
+        self.path = path
+        self.keep = keep
+        self.sync_batch = sync_batch
+        self.max_bytes = max_bytes
+        self.compact_size = max_bytes
+        # The number of bytes removed from the start of the log by
+        # compaction, which positions returned by read_page account for.
+        self.dropped_bytes = 0
+        self.num_unsynced = 0
+        self.file = None
+        self._open()
+
+    def append(self, input_string, result_string):
+        self.file.write(_encode(input_string, result_string))
+        self.file.flush()
+        self.num_unsynced += 1
+        if self.num_unsynced >= self.sync_batch:
+            self.sync()
+        if self.file.tell() > self.compact_size:
+            self.compact()
+
+    def close(self):
+        if self.file:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    def compact(self):
+        '''
+        Rewrite the log with only its newest keep entries. The new log is
+        written to a temporary file which then replaces the old one, so a
+        crash during compaction leaves one of the two intact.
+
+        The log is next compacted once it has doubled in size, or reached
+        max_bytes, so that it is not rewritten on every append when the
+        entries kept take more than max_bytes.
+        '''
+        start = self.read_page(self.keep)[1] - self.dropped_bytes
+        temporary_path = self.path + '.tmp'
+        with open(self.path, 'rb') as source:
+            with open(temporary_path, 'wb') as file:
+                # The entries kept are copied as they are, so that positions
+                # in the log only move by the bytes dropped before them.
+                source.seek(start)
+                shutil.copyfileobj(source, file)
+                file.flush()
+                os.fsync(file.fileno())
+        self.file.close()
+        os.replace(temporary_path, self.path)
+        self.dropped_bytes += start
+        self._open()
+        self.compact_size = max(self.max_bytes, 2 * self.file.tell())
+
+    def read_last(self, count):
+        '''
+        Return up to count (input_string, result_string) tuples of the newest
+        entries, newest first. The log is scanned backwards from its end, so
+        older entries are never read.
+        '''
+        return self.read_page(count)[0]
+
+    def read_page(self, count, position=None):
+        '''
+        Return up to count (input_string, result_string) tuples of the
+        entries before a position in the log, newest first, and the position
+        of the oldest of them, before which the next page is read. Positions
+        stay valid when the log is appended to or compacted, but the entries
+        dropped by compaction are no longer read.
+
+        position: a position returned by read_page, or None to read the
+            newest entries
+        '''
+        entries = []
+        if position is None:
+            position = self.dropped_bytes + os.path.getsize(self.path)
+        end = position - self.dropped_bytes
+        if end <= 0:
+            return entries, position
+        with open(self.path, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                # A last line without a newline was cut off by a crash.
+                end = data.rfind(b'\n', 0, end)
+                start = end + 1
+                while end > 0 and len(entries) < count:
+                    start = data.rfind(b'\n', 0, end) + 1
+                    entry = _decode(data[start:end])
+                    if entry:
+                        entries.append(entry)
+                    end = start - 1
+        return entries, self.dropped_bytes + start
+
+    def sync(self):
+        if self.num_unsynced:
+            os.fsync(self.file.fileno())
+            self.num_unsynced = 0
+
+    def _open(self):
+        self.file = open(self.path, 'ab')
+        # Remove an entry cut off by a crash, which could otherwise be read
+        # as a complete one once another entry is appended after it.
+        if self.file.tell():
+            with open(self.path, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b'\n':
+                    with mmap.mmap(file.fileno(), 0,
+                        access=mmap.ACCESS_READ) as data:
+                            end = data.rfind(b'\n') + 1
+                    self.file.truncate(end)
+
+
+_ESCAPES = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'}
+_UNESCAPES = {escape[1]: char for char, escape in _ESCAPES.items()}
+_ESCAPED_CHARS = re.compile(r'[\\\t\n\r]')
+_ESCAPE_SEQUENCES = re.compile(r'\\(.)')
+
+
+def _encode(input_string, result_string):
+    return ('%s\t%s\n' % (_escape(input_string), _escape(result_string))).encode()
+
+
+def _decode(line):
+    try:
+        input_string, result_string = line.decode().split('\t')
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return _unescape(input_string), _unescape(result_string)
+
+
+def _escape(string):
+    return _ESCAPED_CHARS.sub(lambda match: _ESCAPES[match.group()], string)
+
+
+def _unescape(string):
+    return _ESCAPE_SEQUENCES.sub(
+        lambda match: _UNESCAPES.get(match.group(1), match.group(1)), string)
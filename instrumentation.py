@@ -0,0 +1,208 @@
+# Records where the time of the calculator goes: latency histograms of the
+# phases of the Controller's pipeline and call counts of Parser.parse and
+# Operation.get_value. The calls made by the evaluation worker process are
+# counted there and added to the counts of the Controller's process with
+# add_counts.
+#
+# Instrumentation is off unless the CALCULATOR_INSTRUMENTATION environment
+# variable is set. When off, time_phase returns a shared context manager which
+# does nothing and no method is wrapped. When CALCULATOR_INSTRUMENTATION_FILE
+# is also set, the statistics are written to that file as JSON on exit.
+import atexit
+import json
+import os
+import time
+from collections import Counter
+import expressionparser as ep
+
+ENVIRONMENT_VARIABLE = 'CALCULATOR_INSTRUMENTATION'
+FILE_ENVIRONMENT_VARIABLE = 'CALCULATOR_INSTRUMENTATION_FILE'
+
+# (class, method name, counter name) of the methods whose calls are counted.
+# Operation.get_value evaluates a whole tree without calling itself on the
+# operations inside it, so its count is the number of evaluated trees.
+COUNTED_METHODS = (
+    (ep.Parser, 'parse', 'Parser.parse'),
+    (ep.Operation, 'get_value', 'Operation.get_value')
+)
+
+class LatencyHistogram:
+    '''
+    Histogram of latencies in buckets whose bounds are powers of two
+    microseconds. Bucket i holds the latencies of at least 2**(i-1) and less
+    than 2**i microseconds; bucket 0 those under one microsecond.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = []
+
+    def get_mean(self):
+        return self.total / self.count if self.count else None
+
+    def get_percentile(self, fraction):
+        '''
+        Return the upper bound in seconds of the bucket holding the given
+        fraction of the latencies, or None if none were recorded.
+        '''
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank:
+                return min((1 << index) / 1e6, self.max)
+        return self.max
+
+    def get_summary(self):
+        return {
+            'count': self.count,
+            'mean': self.get_mean(),
+            'min': self.min,
+            'max': self.max,
+            'p50': self.get_percentile(0.5),
+            'p90': self.get_percentile(0.9),
+            'p99': self.get_percentile(0.99),
+            'buckets': list(self.buckets)
+        }
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        index = int(seconds * 1e6).bit_length()
+        if index >= len(self.buckets):
+            self.buckets.extend([0] * (index + 1 - len(self.buckets)))
+        self.buckets[index] += 1
+
+
+class Instrumentation:
+    def __init__(self, enabled=False):
+        '''
+        Initializes an Instrumentation object.
+
+        enabled: whether to start recording immediately
+        '''
+        self.enabled = False
+        self.histograms = {}
+        self.counters = Counter()
+        self.original_methods = []
+        if enabled:
+            self.enable()
+
+    def add_counts(self, counts):
+        '''
+        Add call counts recorded in another process, as a dict mapping
+        counter names to numbers of calls.
+        '''
+        if self.enabled:
+            self.counters.update(counts)
+
+    def disable(self):
+        '''
+        Stop recording and restore the counted methods. The statistics
+        recorded so far are kept.
+        '''
+        for cls, name, method in self.original_methods:
+            setattr(cls, name, method)
+        self.original_methods = []
+        self.enabled = False
+
+    def dump(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.get_stats(), file, indent=2)
+
+    def enable(self):
+        '''
+        Start recording. The methods of COUNTED_METHODS are replaced by
+        wrappers counting their calls in this process.
+        '''
+        if self.enabled:
+            return
+        for cls, name, counter in COUNTED_METHODS:
+            method = cls.__dict__[name]
+            self.original_methods.append((cls, name, method))
+            setattr(cls, name, self._make_counted(method, counter))
+        self.enabled = True
+
+    def get_stats(self):
+        '''
+        Return a dict with the summaries of the phase histograms, by phase,
+        and the call counts, by method.
+        '''
+        return {
+            'phases': {phase: histogram.get_summary()
+                for phase, histogram in self.histograms.items()},
+            'counts': dict(self.counters)
+        }
+
+    def is_enabled(self):
+        return self.enabled
+
+    def record(self, phase, seconds):
+        if not self.enabled:
+            return
+        try:
+            histogram = self.histograms[phase]
+        except KeyError:
+            histogram = self.histograms[phase] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def reset(self):
+        self.histograms = {}
+        self.counters.clear()
+
+    def time_phase(self, phase):
+        '''
+        Return a context manager recording the time spent in its body as a
+        latency of the given phase.
+        '''
+        if self.enabled:
+            return _PhaseTimer(self, phase)
+        return _NULL_TIMER
+
+    def _make_counted(self, method, counter):
+        counters = self.counters
+        def counted(*args, **kwargs):
+            counters[counter] += 1
+            return method(*args, **kwargs)
+        counted.__wrapped__ = method
+        return counted
+
+
+class _PhaseTimer:
+    __slots__ = ('instrumentation', 'phase', 'start')
+
+    def __init__(self, instrumentation, phase):
+        self.instrumentation = instrumentation
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.record(self.phase, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+instrumentation = Instrumentation(bool(os.environ.get(ENVIRONMENT_VARIABLE)))
+
+if instrumentation.is_enabled() and os.environ.get(FILE_ENVIRONMENT_VARIABLE):
+    atexit.register(instrumentation.dump, os.environ[FILE_ENVIRONMENT_VARIABLE])
@@ -0,0 +1,144 @@
+# Measures the throughput and latency of an evaluation server. Each
+# connection keeps a fixed number of requests in flight, cycling through a
+# list of expressions, and the latency of each request is the time from
+# sending it to receiving its response.
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+import evaluationserver as es
+
+# A mix of cheap expressions, degree-mode trigonometry and large results
+# which the server computes in its process pool.
+DEFAULT_EXPRESSIONS = [
+    '1+2*3',
+    '2^10-3!',
+    'sin(30)+cos(60)',
+    'sqrt(2)*pi/4',
+    'ln(e^2)+log(1000)',
+    '(1.5+2.25)*(3-4/5)',
+    '20!/18!',
+    '3^40000'
+]
+
+async def run_load(expressions, requests=10000, connections=4, depth=32,
+    angle_mode='deg', host=es.DEFAULT_HOST, port=es.DEFAULT_PORT, path=None):
+    '''
+    Send requests to a server and measure their latencies.
+
+    expressions: list of the expressions sent, in turn
+    requests: the number of expressions sent over all connections
+    connections: the number of connections sending requests concurrently
+    depth: the number of requests each connection keeps in flight
+    angle_mode: the angle mode set on each connection, 'deg' or 'rad'
+    host, port, path: the TCP socket, or the Unix socket path if given, of
+        the server
+
+    return: a dict of the number of requests, the elapsed seconds, the
+        throughput in requests per second, latency percentiles in seconds
+        and the count of each status
+    '''
+    counts = [requests // connections + (i < requests % connections)
+        for i in range(connections)]
+    latencies = []
+    statuses = Counter()
+    start_time = time.perf_counter()
+    await asyncio.gather(*(_run_connection(expressions, count, depth,
+        angle_mode, host, port, path, latencies, statuses)
+        for count in counts))
+    elapsed = time.perf_counter() - start_time
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'p50': get_percentile(latencies, 0.5),
+        'p90': get_percentile(latencies, 0.9),
+        'p99': get_percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else None,
+        'statuses': dict(statuses)
+    }
+
+def get_percentile(latencies, fraction):
+    '''
+    Return the latency below which the given fraction of a sorted list of
+    latencies falls, or None if it is empty.
+    '''
+    if not latencies:
+        return None
+    index = min(int(fraction * len(latencies)), len(latencies) - 1)
+    return latencies[index]
+
+async def _run_connection(expressions, count, depth, angle_mode, host, port,
+    path, latencies, statuses):
+    if path:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    writer.write(_encode_request(0, angle_mode=angle_mode))
+    await reader.readline()
+
+    send_times = {}
+    requests = zip(range(1, count + 1), itertools.cycle(expressions))
+
+    def send(number):
+        # Sends up to number requests with a single write.
+        lines = []
+        for request_id, expression in itertools.islice(requests, number):
+            send_times[request_id] = time.perf_counter()
+            lines.append(_encode_request(request_id, expression=expression))
+        writer.write(b''.join(lines))
+
+    send(depth)
+    for i in range(count):
+        response = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - send_times.pop(response['id']))
+        statuses[response['status']] += 1
+        send(1)
+    writer.close()
+    await writer.wait_closed()
+
+def _encode_request(request_id, **fields):
+    return json.dumps(dict(id=request_id, **fields)).encode('utf-8') + b'\n'
+
+def main(args=None):
+    argparser = argparse.ArgumentParser(
+        description='Measure the throughput and latency of an evaluation server.')
+    argparser.add_argument('file', nargs='?',
+        help='file of expressions, one per line (default: a built-in mix)')
+    argparser.add_argument('--host', default=es.DEFAULT_HOST)
+    argparser.add_argument('--port', type=int, default=es.DEFAULT_PORT)
+    argparser.add_argument('--unix', metavar='PATH',
+        help='connect to a Unix socket instead of TCP')
+    argparser.add_argument('--requests', type=int, default=10000,
+        help='number of requests sent')
+    argparser.add_argument('--connections', type=int, default=4,
+        help='number of concurrent connections')
+    argparser.add_argument('--depth', type=int, default=32,
+        help='number of requests in flight per connection')
+    argparser.add_argument('--radians', action='store_true',
+        help='take trigonometric arguments in radians rather than degrees')
+    args = argparser.parse_args(args)
+
+    if args.file:
+        with open(args.file) as file:
+            expressions = [line.rstrip('\r\n') for line in file if line.strip()]
+    else:
+        expressions = DEFAULT_EXPRESSIONS
+    stats = asyncio.run(run_load(expressions, args.requests,
+        args.connections, args.depth, 'rad' if args.radians else 'deg',
+        args.host, args.port, args.unix))
+
+    print('%d requests in %.3f s: %.0f requests/s' % (stats['requests'],
+        stats['seconds'], stats['throughput']))
+    for name in ('p50', 'p90', 'p99', 'max'):
+        if stats[name] is not None:
+            print('%s latency: %.3f ms' % (name, stats[name] * 1000))
+    print('statuses: %s' % ', '.join('%s %d' % item
+        for item in sorted(stats['statuses'].items())))
+
+if __name__ == '__main__':
+    main()
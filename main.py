@@ -1,12 +1,53 @@
+import startupprofile as stp
 import tkinter as tk
-import expressionparser as ep
+import evaluationworker as ew
+import instrumentation as ins
+import mathbackends as mb
+import os
 import string
 import view
+from model import Model
 
 class Controller:
-    def __init__(self):
-        self.model = Model()
-        self.view = view.View()
+    EVALUATION_BUDGET = 5.0
+    POLL_INTERVAL = 10
+    PREVIEW_DELAY = 40
+    COMPUTING_DELAY = 0.1
+    RESULT_MESSAGES = {
+        ew.SYNTAX_ERROR: '',
+        ew.ZERO_DIVISION: 'DIV/0 ERROR',
+        ew.MATH_ERROR: 'MATH ERROR',
+        ew.TOO_LARGE: 'TOO LARGE',
+        ew.TIMEOUT: 'TIMEOUT'
+    }
+
+    HISTORY_FILE = os.path.join(os.path.expanduser('~'), '.calculator_history')
+    BACKEND_VARIABLE = 'CALCULATOR_BACKEND'
+    PRECISION_VARIABLE = 'CALCULATOR_PRECISION'
+
+    def __init__(self, history_path=None, lazy=False, backend='math',
+        precision=None):
+        '''
+        Initializes a Controller object.
+
+        history_path: the path of the history log, or None to keep the
+            history in memory only
+        lazy: whether the View builds the widgets which are not needed for
+            the first frame after it has been shown
+        backend, precision: the name of the math backend used for the
+            session and its precision, as taken by mathbackends.get_backend
+        '''
+        self.model = Model(history_path, mb.get_backend(backend, precision))
+        self.view = view.View(lazy, Model.LOG_KEEP)
+        self.worker = ew.EvaluationWorker(Controller.EVALUATION_BUDGET,
+            backend=backend, precision=precision,
+            count_calls=ins.instrumentation.is_enabled())
+        self.last_result = (ew.SYNTAX_ERROR, None, None, None)
+        self.execute_pending = False
+        self.poll_id = None
+        self.plot_mode = False
+        self.preview_delay = Controller.PREVIEW_DELAY
+        self.update_id = None
 
         self.button_functions = {
             '=': self.execute_operation,
@@ -15,8 +56,11 @@ class Controller:
 
         self._set_bindings()
         self.view.set_angle_mode_observer(self.update_angle_mode)
-        self.view.set_input_observer(self.update_operation)
-        self.update_angle_mode()
+        self.view.set_input_observer(self.schedule_update)
+        self._load_history()
+        # The first evaluation starts the worker process, which waits until
+        # every widget has been built.
+        self.view.add_build_observer(self.update_angle_mode)
 
     def add_entry(self, entry):
         self.view.append_to_input(entry)
@@ -24,31 +68,65 @@ class Controller:
     def backspace(self, args=None):
         self.view.backspace()
 
+    def close(self):
+        self.worker.stop()
+        self.model.close()
+
     def clear_input_display(self, *args):
         self.view.clear_input()
         self.view.set_current_result('')
 
     def execute_operation(self, args=None):
-        try:
-            self.model.get_result()
-        except ZeroDivisionError:
-            pass
-        except ep.MathSyntaxError:
-            self.view.set_current_result('SYNTAX ERROR')
-        else:        
-            self.model.push_operation_to_history()
-            self._update_history_display()
-            self.clear_input_display()
+        # The result is computed by the worker; if it is not ready yet the
+        # operation is executed once it arrives.
+        self.flush_update()
+        if self.worker.is_busy():
+            self.execute_pending = True
+        else:
+            self._finish_execution()
+
+    def flush_update(self):
+        '''
+        Run the scheduled preview update now, if there is one.
+        '''
+        if self.update_id is not None:
+            self.update_operation()
+
+    def schedule_update(self, *args):
+        '''
+        Update the preview once preview_delay milliseconds have passed. The
+        changes made to the input in the meantime, such as the characters of
+        a burst of typing or the clear and insert of set_input_display, are
+        all covered by that single update.
+        '''
+        if self.update_id is None:
+            self.update_id = self.view.after(self.preview_delay,
+                self.update_operation)
+
+    def set_preview_delay(self, milliseconds):
+        self.preview_delay = milliseconds
+
+    def toggle_plot(self, *args):
+        '''
+        Show or hide the plot of the input against the variable x.
+        '''
+        self.plot_mode = not self.plot_mode
+        if self.plot_mode:
+            self._update_plot()
+        else:
+            self.view.hide_plot()
 
     def update_operation(self, *args):
+        if self.update_id is not None:
+            self.view.after_cancel(self.update_id)
+            self.update_id = None
         expression = self.view.get_input()
-        self.model.set_operation_from_expression(expression)
-        try:
-            self.view.set_current_result('= ' + str(self.model.get_result()))
-        except ZeroDivisionError:
-            self.view.set_current_result('DIV/0 ERROR')
-        except ep.MathSyntaxError:
-            self.view.set_current_result('')
+        self.execute_pending = False
+        with ins.instrumentation.time_phase('submit'):
+            self.worker.submit(expression, self.model.get_use_degrees())
+        self._schedule_poll()
+        if self.plot_mode:
+            self._update_plot()
 
     def set_input_display(self, text):
         self.view.set_input_display(text)
@@ -56,6 +134,58 @@ class Controller:
     def update_angle_mode(self, *args):
         mode = self.view.get_angle_mode()
         self.model.set_angle_mode(mode)
+        self.update_operation()
+
+    def _finish_execution(self):
+        self.execute_pending = False
+        status, value, result_string, input_string = self.last_result
+        if status == ew.OK:
+            with ins.instrumentation.time_phase('history update'):
+                self.model.push_to_history(input_string, result_string, value)
+                self._show_new_history_entry()
+            self.clear_input_display()
+        elif status == ew.SYNTAX_ERROR:
+            self.view.set_current_result('SYNTAX ERROR')
+
+    def _poll_worker(self):
+        self.poll_id = None
+        result = self.worker.poll()
+        if result is None:
+            if self.worker.is_busy():
+                if self.worker.get_elapsed() > Controller.COMPUTING_DELAY:
+                    self.view.set_current_result('computing\u2026')
+                self._schedule_poll()
+            return
+
+        self.last_result = result
+        self._record_worker_timings()
+        status, value, result_string, input_string = result
+        with ins.instrumentation.time_phase('widget update'):
+            if status == ew.OK:
+                self.view.set_current_result('= ' + result_string)
+            else:
+                self.view.set_current_result(Controller.RESULT_MESSAGES[status])
+        if self.execute_pending:
+            self._finish_execution()
+
+    def _record_worker_timings(self):
+        if not ins.instrumentation.is_enabled():
+            return
+        # The time from submission to the result being received includes
+        # the wait for the worker process and the polling interval.
+        ins.instrumentation.record('preview latency', self.worker.get_elapsed())
+        timings = self.worker.get_timings()
+        if timings:
+            ins.instrumentation.record('evaluate', timings[0])
+            ins.instrumentation.record('stringify', timings[1])
+        counts = self.worker.get_counts()
+        if counts:
+            ins.instrumentation.add_counts(counts)
+
+    def _schedule_poll(self):
+        if self.poll_id is None:
+            self.poll_id = self.view.after(Controller.POLL_INTERVAL,
+                self._poll_worker)
 
     def _handle_button_input(self, key):
         try:
@@ -80,59 +210,42 @@ class Controller:
     def _set_key_bindings(self):
         self.view.bind('<BackSpace>', self.backspace)
         self.view.bind('<Return>', self.execute_operation)
+        self.view.bind_all('<Control-p>', self.toggle_plot)
 
-    def _update_history_display(self):
-        history = self.model.get_history()
-        history_length = len(history)
-        for i in range(history_length):
-            operation = history[i]
-            input_string = str(operation)
-            result_string = str(operation.get_value())
-            try:
-                self.view.set_history_entry(i, input_string, result_string)
-            except IndexError:
-                break
-
-
-class Model:
-    HIST_SIZE = 100
-    ANGLE_MODES = {
-        'deg': True,
-        'rad': False
-    }
-    def __init__(self):
-        self.history = []
-        self.current_operation = None
-        self.parser = ep.Parser()
+    def _load_history(self):
+        # Only the entries in the visible rows are read from the log. The
+        # history display reads older ones as it is scrolled up to them.
+        self.model.load_history(view.View.HISTORY_ROWS)
+        for entry in reversed(self.model.get_history()):
+            self.view.push_history_entry(entry.input_string, entry.result_string)
+        self.view.set_history_loader(self.model.read_older_history)
 
-    def get_current_operation(self):
-        return self.current_operation
-    
-    def get_history(self):
-        return self.history
+    def _update_plot(self):
+        operation = self.model.get_plot_operation(self.view.get_input())
+        self.view.show_plot(operation, self.model.get_plot_trig_config())
 
-    def push_operation_to_history(self):
-        print('pushing %s to history' % str(self.current_operation))
-        while len(self.history) >= Model.HIST_SIZE:
-            self.history.pop()
-        self.history.insert(0, self.current_operation)
-        self.current_operation = None
+    def _show_new_history_entry(self):
+        entry = self.model.get_history_entry(0)
+        self.view.push_history_entry(entry.input_string, entry.result_string)
 
-    def set_angle_mode(self, mode):
-        use_degrees = Model.ANGLE_MODES[mode]
-        self.parser.set_use_degrees(use_degrees)
 
-    def set_operation_from_expression(self, expression):
-        self.current_operation = self.parser.parse(expression)
+def _finish_startup_profile():
+    stp.profile.mark('remaining widgets')
+    stp.profile.report()
 
-    def get_result(self):
-        return self.current_operation.get_value()
 
-        
 if __name__ == '__main__':
+    stp.profile.mark('import')
     root = tk.Tk()
     root.title('Calculator')
     root.iconbitmap('icons/Dtafalonso-Calculator.ico')
     root.option_add('*Font', ('Segoe UI', 14))
-    app = Controller()
-    root.mainloop()
\ No newline at end of file
+    precision = os.environ.get(Controller.PRECISION_VARIABLE)
+    app = Controller(Controller.HISTORY_FILE, lazy=True,
+        backend=os.environ.get(Controller.BACKEND_VARIABLE, 'math'),
+        precision=int(precision) if precision else None)
+    stp.profile.mark('first frame widgets')
+    root.after_idle(stp.profile.mark, 'first paint')
+    app.view.add_build_observer(_finish_startup_profile)
+    root.mainloop()
+    app.close()
\ No newline at end of file
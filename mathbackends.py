@@ -0,0 +1,198 @@
+# Interchangeable implementations of the functions, constants and number type
+# of the calculator, so that a session can trade speed for precision:
+#
+#   math    Python floats, the fastest for single values
+#   numpy   NumPy float64, matching the vectorized evaluator
+#   mpmath  arbitrary precision numbers, if mpmath is installed
+#
+# The functions available in expressions are listed in a registry. Each
+# backend implements a registered function with the attribute of the same
+# name of its module, unless the registration gives another name for it.
+#
+# Every backend raises where the math module does, so the choice of backend
+# changes the precision and speed of the results but not which expressions
+# are errors: division by zero raises ZeroDivisionError, and functions and
+# powers outside their domain raise instead of returning nan, an infinity
+# or a complex number.
+import math
+from collections import namedtuple
+import costmodel as cm
+
+# Kinds of functions. The angle unit of a TrigConfigurator applies to the
+# argument of ANGLE_ARGUMENT functions and the result of ANGLE_RESULT ones.
+PLAIN = 'plain'
+ANGLE_ARGUMENT = 'angle_argument'
+ANGLE_RESULT = 'angle_result'
+
+FunctionSpec = namedtuple('FunctionSpec', 'kind attributes')
+
+FUNCTIONS = {}
+
+def register_function(name, kind=PLAIN, **attributes):
+    '''
+    Make a function available in expressions. Parsers created afterwards,
+    or whose angle mode is set afterwards, recognize it.
+
+    name: the name of the function in expressions
+    kind: PLAIN, ANGLE_ARGUMENT or ANGLE_RESULT
+    attributes: for each backend whose module names the function
+        differently, the backend name mapped to the attribute name
+    '''
+    FUNCTIONS[name] = FunctionSpec(kind, attributes)
+
+def get_function_kind(name):
+    return FUNCTIONS[name].kind
+
+
+register_function('sin', ANGLE_ARGUMENT)
+register_function('cos', ANGLE_ARGUMENT)
+register_function('tan', ANGLE_ARGUMENT)
+register_function('asin', ANGLE_RESULT, numpy='arcsin')
+register_function('acos', ANGLE_RESULT, numpy='arccos')
+register_function('atan', ANGLE_RESULT, numpy='arctan')
+register_function('sqrt')
+register_function('exp')
+register_function('ln', math='log', numpy='log')
+register_function('log', math='log10', numpy='log10', mpmath='log10')
+
+
+class MathBackend:
+    def __init__(self, name, module, constants, operators=None,
+        make_float=float, check_function=None):
+        '''
+        Initializes a MathBackend object.
+
+        name: the name of the backend, used to look up function attributes
+            in the registry
+        module: the object providing the functions, and radians and degrees
+        constants: a dict mapping constant names to their values
+        operators: a dict mapping operator symbols to functions replacing
+            the default ones of the Parser
+        make_float: function converting the string of a number with a
+            decimal point to a number
+        check_function: function returning a version of a function of
+            module which raises on domain errors as the math module does,
+            for modules which return nan, infinities or complex numbers
+            instead
+        '''
+        self.name = name
+        self.module = module
+        self.constants = constants
+        self.operators = operators or {}
+        self.make_float = make_float
+        self.check_function = check_function
+        self.functions = {}
+
+    def degrees(self, num):
+        return self.module.degrees(num)
+
+    def get_function(self, name):
+        '''
+        Return the implementation of the registered function name, which
+        raises on domain errors as the math module does.
+        '''
+        try:
+            return self.functions[name]
+        except KeyError:
+            function = self.get_module_function(name)
+            if self.check_function:
+                function = self.check_function(function)
+            self.functions[name] = function
+            return function
+
+    def get_module_function(self, name):
+        '''
+        Return the attribute of module implementing the registered function
+        name, without the checks of get_function.
+        '''
+        attribute = FUNCTIONS[name].attributes.get(self.name, name)
+        return getattr(self.module, attribute)
+
+    def get_name(self):
+        return self.name
+
+    def radians(self, num):
+        return self.module.radians(num)
+
+
+MATH_BACKEND = MathBackend('math', math, {'pi': math.pi, 'e': math.e})
+
+_numpy_backend = None
+
+def get_backend(name='math', precision=None):
+    '''
+    Return a backend by name.
+
+    name: 'math', 'numpy' or 'mpmath'. NumPy and mpmath are imported on
+        first use, and raise ImportError if they are not installed.
+    precision: the number of significant decimal digits of mpmath numbers,
+        50 by default. Ignored by the other backends.
+    '''
+    global _numpy_backend
+    if name == 'math':
+        return MATH_BACKEND
+    elif name == 'numpy':
+        if not _numpy_backend:
+            _numpy_backend = _make_numpy_backend()
+        return _numpy_backend
+    elif name == 'mpmath':
+        return _make_mpmath_backend(precision or 50)
+    else:
+        raise ValueError('unknown backend %r' % name)
+
+
+def _make_numpy_backend():
+    import numpy as np
+
+    def check_function(function):
+        # Invalid arguments and overflows raise FloatingPointError, an
+        # ArithmeticError, instead of returning nan or an infinity with a
+        # RuntimeWarning.
+        def checked_function(*args):
+            with np.errstate(all='raise'):
+                return function(*args)
+        return checked_function
+
+    def divide(a, b):
+        if b == 0:
+            raise ZeroDivisionError('division by zero')
+        return a / b
+
+    return MathBackend('numpy', np,
+        {'pi': np.float64(np.pi), 'e': np.float64(np.e)},
+        {'/': divide, '^': check_function(cm.cost_model.power)},
+        np.float64, check_function)
+
+
+def _make_mpmath_backend(precision):
+    import mpmath
+    # Each backend has its own context, so its precision does not affect
+    # other users of mpmath.
+    context = mpmath.MPContext()
+    context.dps = precision
+
+    def divide(a, b):
+        return context.mpf(a) / b
+
+    def check_function(function):
+        # Results are real, as those of the math module: a complex result,
+        # or an infinity from finite arguments, is a domain error.
+        def checked_function(*args):
+            result = function(*args)
+            if isinstance(result, context.mpc) or (context.isinf(result) and
+                not any(context.isinf(arg) for arg in args)):
+                    raise ValueError('math domain error')
+            return result
+        return checked_function
+
+    def power(base, exponent):
+        # Exact integer powers stay integers, within the cost model's limit.
+        if type(base) is int and type(exponent) is int and exponent >= 0:
+            return cm.cost_model.power(base, exponent)
+        return context.power(base, exponent)
+
+    power = check_function(power)
+
+    return MathBackend('mpmath', context,
+        {'pi': +context.pi, 'e': +context.e},
+        {'/': divide, '^': power}, context.mpf, check_function)
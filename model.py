@@ -0,0 +1,145 @@
+from collections import deque, namedtuple
+import expressioninterner as ei
+import expressionparser as ep
+import historylog as hl
+
+class Model:
+    HIST_SIZE = 100
+    # The number of entries kept by the history log when it is compacted,
+    # which can all be scrolled through.
+    LOG_KEEP = 50000
+    PARSE_CACHE_SIZE = 256
+    PLOT_VARIABLE = 'x'
+    ANGLE_MODES = {
+        'deg': True,
+        'rad': False
+    }
+    def __init__(self, history_path=None, backend=None):
+        '''
+        Initializes a Model object.
+
+        history_path: the path of the log the history is saved to, or None
+            to keep the history in memory only. Saved entries are loaded by
+            load_history.
+        backend: the MathBackend of the parser, by default the math module
+        '''
+        # Newest entry first. The deque drops the oldest entry when full.
+        self.history = deque(maxlen=Model.HIST_SIZE)
+        self.current_operation = None
+        self.parser = ep.IncrementalParser(cache_size=Model.PARSE_CACHE_SIZE,
+            backend=backend)
+        self.plot_parser = ep.Parser(variables=(Model.PLOT_VARIABLE,),
+            cache_size=Model.PARSE_CACHE_SIZE)
+        # Plotted trees are interned, so that each repeated subexpression is
+        # evaluated once for every array of samples.
+        self.plot_interner = ei.Interner()
+        self.history_log = None
+        # The position in the log before which the older entries are read.
+        self.history_position = None
+        if history_path:
+            self.history_log = hl.HistoryLog(history_path, Model.LOG_KEEP)
+
+    def close(self):
+        '''
+        Sync the history log to disk and close it.
+        '''
+        if self.history_log:
+            self.history_log.close()
+
+    def get_current_operation(self):
+        return self.current_operation
+    
+    def get_history(self):
+        return self.history
+
+    def get_history_entry(self, index):
+        return self.history[index]
+
+    def get_plot_operation(self, expression):
+        '''
+        Parse an expression to be plotted against PLOT_VARIABLE.
+
+        return: the interned operation tree, or None if the expression is
+            invalid
+        '''
+        try:
+            return self.plot_interner.intern(self.plot_parser.parse(expression))
+        except (ep.MathSyntaxError, ep.UnexpectedOperandError, ValueError):
+            return None
+
+    def get_plot_trig_config(self):
+        return self.plot_parser.trig_config
+
+    def get_use_degrees(self):
+        return self.parser.trig_config.use_degrees
+
+    def load_history(self, count):
+        '''
+        Load the newest count entries of the history log, or fewer if the
+        log is shorter. Loaded entries have no value, since only their
+        strings are saved.
+        '''
+        if not self.history_log:
+            return
+        count = min(count, Model.HIST_SIZE - len(self.history))
+        entries, self.history_position = self.history_log.read_page(count,
+            self.history_position)
+        for input_string, result_string in entries:
+            self.history.append(HistoryEntry(input_string, result_string, None))
+
+    def read_older_history(self, count):
+        '''
+        Return up to count (input_string, result_string) tuples of the saved
+        entries older than those loaded by load_history or returned by the
+        previous calls, newest first. They are not added to the history.
+        '''
+        if not self.history_log:
+            return []
+        entries, self.history_position = self.history_log.read_page(count,
+            self.history_position)
+        return entries
+
+    def push_operation_to_history(self, result_string, value=None):
+        '''
+        Push the current operation to the history together with its result,
+        which has already been computed by the evaluation worker. The entry
+        is frozen as strings and a value, so it is never converted or
+        evaluated again.
+        '''
+        self.push_to_history(str(self.current_operation), result_string, value)
+        self.current_operation = None
+
+    def push_to_history(self, input_string, result_string, value=None):
+        '''
+        Push an entry to the history, for an expression which was parsed
+        and evaluated elsewhere, such as by the evaluation worker.
+
+        input_string: the parsed expression as written by str
+        '''
+        entry = HistoryEntry(input_string, result_string, value)
+        self.history.appendleft(entry)
+        if self.history_log:
+            self.history_log.append(entry.input_string, entry.result_string)
+
+    def set_angle_mode(self, mode):
+        use_degrees = Model.ANGLE_MODES[mode]
+        self.parser.set_use_degrees(use_degrees)
+        self.plot_parser.set_use_degrees(use_degrees)
+
+    def set_operation_from_expression(self, expression):
+        '''
+        Parse an expression as the current operation, which is None if the
+        expression is invalid.
+        '''
+        try:
+            self.current_operation = self.parser.parse(expression)
+        except (ep.MathSyntaxError, ep.UnexpectedOperandError, ValueError):
+            self.current_operation = None
+
+    def get_result(self):
+        if self.current_operation is None:
+            raise ep.MathSyntaxError
+        return self.current_operation.get_value()
+
+
+HistoryEntry = namedtuple('HistoryEntry', 'input_string result_string value')
@@ -0,0 +1,386 @@
+# Graphs an expression in one free variable on a Canvas. The expression is
+# evaluated over NumPy arrays with the vectorized evaluator, first on a coarse
+# grid and then at the midpoints of the intervals where the curve bends
+# sharply or jumps, such as near the asymptotes of tan. Each refinement step
+# runs in its own after() callback and redraws the parts of the curve it
+# refined, so the window stays responsive while the plot sharpens. Samples
+# near the plotted range are kept across pans and zooms.
+import tkinter as tk
+import numpy as np
+import expressionparser as ep
+import vectorized as vz
+
+class SampleCache:
+    '''
+    Sorted samples (x, y) of one function, kept for reuse when the plotted
+    range changes.
+    '''
+    def __init__(self):
+        self.xs = np.empty(0)
+        self.ys = np.empty(0)
+
+    def add(self, xs, ys):
+        xs = np.concatenate((self.xs, xs))
+        ys = np.concatenate((self.ys, ys))
+        xs, indices = np.unique(xs, return_index=True)
+        self.xs = xs
+        self.ys = ys[indices]
+
+    def get_range(self, start, stop):
+        '''
+        Return the arrays of x and y of the samples between start and stop,
+        inclusive.
+        '''
+        first = np.searchsorted(self.xs, start, 'left')
+        last = np.searchsorted(self.xs, stop, 'right')
+        return self.xs[first:last], self.ys[first:last]
+
+    def prune(self, start, stop):
+        '''
+        Drop the samples outside start and stop, inclusive.
+        '''
+        first = np.searchsorted(self.xs, start, 'left')
+        last = np.searchsorted(self.xs, stop, 'right')
+        if first > 0 or last < len(self.xs):
+            # Copied so that the memory of the dropped samples is freed.
+            self.xs = self.xs[first:last].copy()
+            self.ys = self.ys[first:last].copy()
+
+    def get_uncovered(self, grid, spacing):
+        '''
+        Return the points of grid farther than spacing/2 from every sample.
+        '''
+        if not len(self.xs):
+            return grid
+        indices = np.clip(np.searchsorted(self.xs, grid), 1, len(self.xs) - 1)
+        distances = np.minimum(np.abs(grid - self.xs[indices - 1]),
+            np.abs(grid - self.xs[indices]))
+        return grid[distances > spacing / 2]
+
+
+class AdaptiveSampler:
+    '''
+    Samples a vectorized function over a range, refining where a straight
+    line between samples would misrepresent it.
+    '''
+    INITIAL_SAMPLES = 64
+    MAX_DEPTH = 10
+    TOLERANCE = 0.002
+
+    def __init__(self, function, start, stop, cache,
+        initial_samples=INITIAL_SAMPLES, max_depth=MAX_DEPTH,
+        tolerance=TOLERANCE):
+        '''
+        Initializes an AdaptiveSampler object.
+
+        function: function taking an array of x and returning an array of y
+        start, stop: the range to sample
+        cache: the SampleCache the samples are added to and reused from
+        initial_samples: the number of points of the initial grid
+        max_depth: the number of times an interval of the initial grid can
+            be halved
+        tolerance: the largest acceptable distance between the curve and
+            the straight line through neighbouring samples, as a fraction
+            of the visible height of the curve
+        '''
+        self.function = function
+        self.start = start
+        self.stop = stop
+        self.cache = cache
+        self.spacing = (stop - start) / (initial_samples - 1)
+        self.min_width = self.spacing / 2 ** max_depth
+        self.tolerance = tolerance
+        self.initial_samples = initial_samples
+
+    def get_min_width(self):
+        return self.min_width
+
+    def steps(self):
+        '''
+        Generate the array of the x of the new samples of each step. The
+        first step samples the initial grid, minus the points already in the
+        cache, and each following one the midpoints of the intervals needing
+        refinement. The generator ends when no interval needs refinement.
+        '''
+        grid = np.linspace(self.start, self.stop, self.initial_samples)
+        yield self._sample(self.cache.get_uncovered(grid, self.spacing))
+        while True:
+            points = self._find_refinement_points()
+            if not len(points):
+                return
+            yield self._sample(points)
+
+    def _find_refinement_points(self):
+        xs, ys = self.cache.get_range(self.start, self.stop)
+        if len(xs) < 3:
+            return np.empty(0)
+        low, high = get_visible_range(ys)
+        limit = self.tolerance * (high - low)
+
+        widths = np.diff(xs)
+        finite = np.isfinite(ys)
+        # Deviation of each inner sample from the chord of its neighbours,
+        # nan unless the three samples are finite.
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            weights = widths[:-1] / (widths[:-1] + widths[1:])
+            chord = ys[:-2] + (ys[2:] - ys[:-2]) * weights
+            bent = np.abs(ys[1:-1] - chord) > limit
+        # An inner sample off its chord refines both of its intervals. An
+        # interval with exactly one finite end, at the edge of the domain or
+        # next to an asymptote, is refined, as is a jump across the whole
+        # visible height. Intervals inside an undefined region are not.
+        refine = np.zeros(len(widths), dtype=bool)
+        refine[:-1] |= bent
+        refine[1:] |= bent
+        refine |= finite[:-1] != finite[1:]
+        with np.errstate(invalid='ignore', over='ignore'):
+            refine |= np.abs(np.diff(ys)) > high - low
+        refine &= widths > 2 * self.min_width
+        return xs[:-1][refine] + widths[refine] / 2
+
+    def _sample(self, xs):
+        if len(xs):
+            ys = np.broadcast_to(self.function(xs), xs.shape).astype(float)
+            self.cache.add(xs, ys)
+        return xs
+
+
+def get_visible_range(ys):
+    '''
+    Return the (low, high) range of y shown for the given samples. Samples
+    far off the bulk of the curve, such as those next to an asymptote, are
+    left out so they do not flatten the rest of it.
+    '''
+    finite = ys[np.isfinite(ys)]
+    if not len(finite):
+        return -1.0, 1.0
+    low, high = np.percentile(finite, [2, 98])
+    if high - low < 1e-12:
+        low, high = low - 1, high + 1
+    margin = (high - low) * 0.1
+    return float(low - margin), float(high + margin)
+
+
+class PlotView(tk.Canvas):
+    WIDTH = 400
+    HEIGHT = 250
+    STEP_DELAY = 1
+    ZOOM_FACTOR = 1.25
+    # The curve is drawn in this many vertical strips, of which each step
+    # only redraws those holding intervals it refined.
+    STRIPS = 32
+    # Samples are kept up to this many widths of the plotted range beyond
+    # either side of it.
+    CACHE_MARGIN = 1.0
+
+    def __init__(self, master, variable='x', x_range=(-10.0, 10.0)):
+        '''
+        Initializes a PlotView object.
+
+        master: a tkinter widget
+        variable: the name of the free variable of the plotted expressions
+        x_range: the (start, stop) range of the variable shown initially
+        '''
+        tk.Canvas.__init__(self, master, width=PlotView.WIDTH,
+            height=PlotView.HEIGHT, background='white', highlightthickness=0)
+        self.variable = variable
+        self.x_range = x_range
+        self.operation = None
+        self.expression = None
+        self.evaluator = None
+        self.cache = SampleCache()
+        self.sampler = None
+        self.steps = None
+        self.step_id = None
+        # The (low, high) range of y shown, fixed between full redraws so
+        # that the strips drawn by each step line up.
+        self.y_range = None
+        self.drag_x = None
+
+        self.bind('<ButtonPress-1>', self._start_drag)
+        self.bind('<B1-Motion>', self._drag)
+        self.bind('<MouseWheel>', self._zoom_by_wheel)
+        self.bind('<Button-4>', lambda event: self.zoom(1 / PlotView.ZOOM_FACTOR, event.x))
+        self.bind('<Button-5>', lambda event: self.zoom(PlotView.ZOOM_FACTOR, event.x))
+        self.bind('<Configure>', lambda event: self._redraw())
+
+    def clear(self):
+        self._stop_sampling()
+        self.operation = None
+        self.expression = None
+        self.delete('all')
+
+    def pan(self, pixels):
+        '''
+        Move the plotted range by a number of pixels, to the left for a
+        positive number.
+        '''
+        start, stop = self.x_range
+        shift = -pixels * (stop - start) / self._get_width()
+        self.set_x_range(start + shift, stop + shift)
+
+    def plot(self, operation, trig_config):
+        '''
+        Plot an operation tree of a Parser whose free variables include the
+        variable of this PlotView. Samples are reused if the expression and
+        angle mode are those of the current plot.
+
+        trig_config: the TrigConfigurator of the Parser
+        '''
+        if operation is None:
+            self.clear()
+            return
+        expression = (str(operation), trig_config.use_degrees)
+        if expression != self.expression:
+            self.cache = SampleCache()
+        self.operation = operation
+        self.expression = expression
+        self.evaluator = vz.VectorEvaluator(trig_config)
+        self._start_sampling()
+
+    def set_x_range(self, start, stop):
+        self.x_range = (start, stop)
+        if self.operation is not None:
+            self._start_sampling()
+
+    def zoom(self, factor, pixel=None):
+        '''
+        Scale the plotted range by factor around the x of a pixel, by
+        default the center.
+        '''
+        start, stop = self.x_range
+        if pixel is None:
+            center = (start + stop) / 2
+        else:
+            center = start + pixel * (stop - start) / self._get_width()
+        self.set_x_range(center + (start - center) * factor,
+            center + (stop - center) * factor)
+
+    def _draw_strip(self, strip, xs, ys):
+        # Draws the part of the curve between the samples in a strip and the
+        # first sample after it, replacing the one drawn before.
+        tag = 'strip%d' % strip
+        self.delete(tag)
+        starts = self._get_strip_starts()
+        first = np.searchsorted(xs, starts[strip], 'left')
+        if strip == PlotView.STRIPS - 1:
+            last = len(xs)
+        else:
+            last = np.searchsorted(xs, starts[strip + 1], 'left') + 1
+        xs = xs[first:last]
+        ys = ys[first:last]
+        if len(xs) < 2:
+            return
+
+        low, high = self.y_range
+        start, stop = self.x_range
+        width, height = self._get_width(), self._get_height()
+        pixel_xs = (xs - start) / (stop - start) * width
+        with np.errstate(invalid='ignore', over='ignore'):
+            pixel_ys = (high - np.clip(ys, 2 * low - high, 2 * high - low)) \
+                / (high - low) * height
+            # Jumps across the visible height which remain at the finest
+            # sampling are discontinuities rather than steep parts of the
+            # curve, so they are not drawn.
+            jumps = (np.abs(np.diff(ys)) > high - low) & \
+                (np.diff(xs) <= 2 * self.sampler.get_min_width())
+        connected = np.isfinite(ys[:-1]) & np.isfinite(ys[1:]) & ~jumps
+
+        points = np.column_stack((pixel_xs, pixel_ys))
+        first = 0
+        for last in np.flatnonzero(~connected).tolist() + [len(xs) - 1]:
+            if last > first:
+                self.create_line(*points[first:last + 1].ravel().tolist(),
+                    fill='#1f5fbf', tags=('curve', tag))
+            first = last + 1
+
+    def _draw_axes(self, low, high):
+        start, stop = self.x_range
+        width, height = self._get_width(), self._get_height()
+        if start <= 0 <= stop:
+            x = -start / (stop - start) * width
+            self.create_line(x, 0, x, height, fill='#bbbbbb', tags='axes')
+        if low <= 0 <= high:
+            y = high / (high - low) * height
+            self.create_line(0, y, width, y, fill='#bbbbbb', tags='axes')
+
+    def _drag(self, event):
+        self.pan(event.x - self.drag_x)
+        self.drag_x = event.x
+
+    def _evaluate(self, xs):
+        return self.evaluator.evaluate(self.operation, **{self.variable: xs})
+
+    def _get_height(self):
+        return max(self.winfo_height(), 2) if self.winfo_ismapped() else PlotView.HEIGHT
+
+    def _get_strip_starts(self):
+        start, stop = self.x_range
+        return start + np.arange(PlotView.STRIPS) * ((stop - start) /
+            PlotView.STRIPS)
+
+    def _get_width(self):
+        return max(self.winfo_width(), 2) if self.winfo_ismapped() else PlotView.WIDTH
+
+    def _redraw(self):
+        # Draws the whole plot, fixing the range of y shown until the next
+        # full redraw.
+        self.delete('all')
+        if self.operation is None or self.sampler is None:
+            return
+        xs, ys = self.cache.get_range(*self.x_range)
+        self.y_range = get_visible_range(ys)
+        self._draw_axes(*self.y_range)
+        for strip in range(PlotView.STRIPS):
+            self._draw_strip(strip, xs, ys)
+
+    def _redraw_refined(self, new_xs):
+        # Redraws the strips holding the intervals split by new samples:
+        # those of the new samples and of the samples before them.
+        xs, ys = self.cache.get_range(*self.x_range)
+        before = xs[np.maximum(np.searchsorted(xs, new_xs) - 1, 0)]
+        strips = np.searchsorted(self._get_strip_starts(),
+            np.concatenate((new_xs, before)), 'right') - 1
+        for strip in np.unique(np.clip(strips, 0, PlotView.STRIPS - 1)).tolist():
+            self._draw_strip(strip, xs, ys)
+
+    def _start_drag(self, event):
+        self.drag_x = event.x
+
+    def _start_sampling(self):
+        self._stop_sampling()
+        start, stop = self.x_range
+        margin = (stop - start) * PlotView.CACHE_MARGIN
+        self.cache.prune(start - margin, stop + margin)
+        self.sampler = AdaptiveSampler(self._evaluate, start, stop, self.cache)
+        self.steps = self.sampler.steps()
+        self.y_range = None
+        self._step()
+
+    def _step(self):
+        # The first step of a sampling draws the whole plot, the following
+        # ones only the parts they refined.
+        self.step_id = None
+        try:
+            new_xs = next(self.steps)
+        except StopIteration:
+            return
+        except (ep.MathSyntaxError, KeyError):
+            self.clear()
+            return
+        if self.y_range is None:
+            self._redraw()
+        elif len(new_xs):
+            self._redraw_refined(new_xs)
+        self.step_id = self.after(PlotView.STEP_DELAY, self._step)
+
+    def _stop_sampling(self):
+        if self.step_id is not None:
+            self.after_cancel(self.step_id)
+            self.step_id = None
+
+    def _zoom_by_wheel(self, event):
+        if event.delta > 0:
+            self.zoom(1 / PlotView.ZOOM_FACTOR, event.x)
+        else:
+            self.zoom(PlotView.ZOOM_FACTOR, event.x)
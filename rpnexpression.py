@@ -0,0 +1,445 @@
+# Compact postfix (reverse Polish) form of parsed expressions. An expression
+# is stored as two flat arrays of opcodes and arguments plus small tables of
+# numbers and names, instead of one Python object per node, and is evaluated
+# by a stack machine.
+#
+# An RPNExpression can be serialized to a compact binary format, so that
+# parsed expressions can be stored or sent to other processes without being
+# parsed again. Operation trees hold functions which cannot be pickled.
+# RPNExpressions are pickled in this format.
+import struct
+import sys
+from array import array
+import expressionparser as ep
+
+NUMBER = 0
+CONSTANT = 1
+VARIABLE = 2
+ADD = 3
+SUBTRACT = 4
+MULTIPLY = 5
+DIVIDE = 6
+INFIX = 7
+POSTFIX = 8
+FUNCTION = 9
+NEGATE = 10
+
+# Serialized format, all little-endian: a header of MAGIC, FORMAT_VERSION,
+# the byte width of the arguments (1, 2 or 4), a reserved byte and the
+# number of opcodes, numbers and names; the opcodes, padded to a multiple of
+# 4 bytes; the arguments, padded likewise; the distinct numbers, each a tag
+# byte followed by its value; the names, each a length byte followed by
+# UTF-8.
+MAGIC = b'RPNX'
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('<4sBBBxIII')
+_ARGUMENT_TYPECODES = {1: 'B', 2: 'H', 4: 'I'}
+
+# Tags of the serialized numbers.
+_FLOAT = 0
+_INT = 1
+_BIG_INT = 2
+_TEXT = 3
+_DOUBLE = struct.Struct('<d')
+_INT32 = struct.Struct('<i')
+_LENGTH = struct.Struct('<I')
+
+ARITHMETIC_OPCODES = {
+    '+': ADD,
+    '-': SUBTRACT,
+    '*': MULTIPLY,
+    '/': DIVIDE
+}
+
+class RPNExpression:
+    '''
+    Postfix form of an operation tree.
+
+    opcodes: array of opcodes, one per node of the tree in post-order
+    arguments: array holding, for each opcode, an index into numbers for
+        NUMBER and into names for CONSTANT, VARIABLE, INFIX, POSTFIX and
+        FUNCTION. It is 0 for the other opcodes.
+    numbers: list of the numeric operands
+    names: list of the symbols of constants, variables, operators and
+        functions. Operators and functions are bound to a Parser by symbol
+        when the expression is evaluated.
+    '''
+    __slots__ = ('opcodes', 'arguments', 'numbers', 'names', 'bindings')
+
+    def __init__(self, opcodes, arguments, numbers, names):
+        self.opcodes = opcodes
+        self.arguments = arguments
+        self.numbers = numbers
+        self.names = names
+        self.bindings = None
+
+    def from_operation(operation):
+        '''
+        Converts an operation tree returned by Parser.parse.
+
+        Raises MathSyntaxError if an operand of the tree is missing.
+        '''
+        opcodes = array('B')
+        arguments = array('I')
+        numbers = []
+        names = []
+        name_indices = {}
+
+        def add_name(opcode, name):
+            key = (opcode, name)
+            if key not in name_indices:
+                name_indices[key] = len(names)
+                names.append(name)
+            return name_indices[key]
+
+        for node in ep.walk_post_order(operation):
+            argument = 0
+            if node is None:
+                raise ep.MathSyntaxError
+            elif isinstance(node, ep.InfixOperation):
+                symbol = node.operator.symbol
+                if symbol in ARITHMETIC_OPCODES:
+                    opcode = ARITHMETIC_OPCODES[symbol]
+                else:
+                    opcode = INFIX
+                    argument = add_name(opcode, symbol)
+            elif isinstance(node, ep.PostfixOperation):
+                symbol = node.operator.symbol
+                if not isinstance(node, ep.Function):
+                    opcode = POSTFIX
+                    argument = add_name(opcode, symbol)
+                elif symbol == '-':
+                    opcode = NEGATE
+                else:
+                    opcode = FUNCTION
+                    argument = add_name(opcode, symbol)
+            elif isinstance(node, ep.Constant):
+                opcode = CONSTANT
+                argument = add_name(opcode, node.key)
+            elif isinstance(node, ep.Variable):
+                opcode = VARIABLE
+                argument = add_name(opcode, node.key)
+            else:
+                opcode = NUMBER
+                argument = len(numbers)
+                numbers.append(node.get_value())
+            opcodes.append(opcode)
+            arguments.append(argument)
+        return RPNExpression(opcodes, arguments, numbers, names)
+
+    from_operation = staticmethod(from_operation)
+
+    def from_bytes(data, make_float=float):
+        '''
+        Restores an expression serialized by to_bytes. The opcodes and
+        arguments are views of data rather than copies where the byte order
+        allows it.
+
+        data: a bytes-like object
+        make_float: function converting the numbers which were stored as
+            text, such as those of the mpmath backend, back to numbers.
+            Usually the make_float of the Parser which evaluates the
+            expression.
+
+        Raises ValueError if data is not a serialized expression of a
+        supported version, or is truncated or corrupt.
+        '''
+        data = memoryview(data).cast('B')
+        if len(data) < _HEADER.size:
+            raise ValueError('not a serialized expression')
+        magic, version, width, reserved, num_opcodes, num_numbers, num_names = \
+            _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('not a serialized expression')
+        if version != FORMAT_VERSION or width not in _ARGUMENT_TYPECODES:
+            raise ValueError('unsupported serialized expression version %d' % version)
+
+        offset = _HEADER.size
+        opcodes = data[offset:offset + num_opcodes]
+        offset += _padded(num_opcodes)
+        arguments = data[offset:offset + num_opcodes * width]
+        offset += _padded(num_opcodes * width)
+        if len(arguments) != num_opcodes * width:
+            raise ValueError('truncated serialized expression')
+        typecode = _ARGUMENT_TYPECODES[width]
+        if sys.byteorder == 'little':
+            arguments = arguments.cast(typecode)
+        else:
+            arguments = array(typecode, arguments)
+            arguments.byteswap()
+
+        try:
+            numbers = []
+            for i in range(num_numbers):
+                tag = data[offset]
+                offset += 1
+                if tag == _FLOAT:
+                    numbers.append(_DOUBLE.unpack_from(data, offset)[0])
+                    offset += _DOUBLE.size
+                elif tag == _INT:
+                    numbers.append(_INT32.unpack_from(data, offset)[0])
+                    offset += _INT32.size
+                else:
+                    length = _LENGTH.unpack_from(data, offset)[0]
+                    offset += _LENGTH.size
+                    value = data[offset:offset + length]
+                    offset += length
+                    if tag == _BIG_INT:
+                        numbers.append(int.from_bytes(value, 'little', signed=True))
+                    elif tag == _TEXT:
+                        numbers.append(make_float(str(value, 'utf-8')))
+                    else:
+                        raise ValueError('corrupt serialized expression')
+            names = []
+            for i in range(num_names):
+                length = data[offset]
+                names.append(str(data[offset + 1:offset + 1 + length], 'utf-8'))
+                offset += 1 + length
+        except (IndexError, struct.error):
+            raise ValueError('truncated serialized expression')
+        _check_program(opcodes, arguments, len(numbers), len(names))
+        return RPNExpression(opcodes, arguments, numbers, names)
+
+    from_bytes = staticmethod(from_bytes)
+
+    def to_bytes(self):
+        '''
+        Serializes the expression to the compact binary format read by
+        from_bytes.
+        '''
+        numbers, arguments = self._get_distinct_numbers()
+        num_opcodes = len(self.opcodes)
+        largest = max(arguments, default=0)
+        width = 1 if largest < 1 << 8 else 2 if largest < 1 << 16 else 4
+        arguments = array(_ARGUMENT_TYPECODES[width], arguments)
+        if sys.byteorder != 'little':
+            arguments.byteswap()
+
+        parts = [
+            _HEADER.pack(MAGIC, FORMAT_VERSION, width, 0, num_opcodes,
+                len(numbers), len(self.names)),
+            bytes(self.opcodes),
+            bytes(_padded(num_opcodes) - num_opcodes),
+            arguments.tobytes(),
+            bytes(_padded(num_opcodes * width) - num_opcodes * width)
+        ]
+        for number in numbers:
+            parts.append(_pack_number(number))
+        for name in self.names:
+            encoded = name.encode('utf-8')
+            parts.append(bytes((len(encoded),)) + encoded)
+        return b''.join(parts)
+
+    def _get_distinct_numbers(self):
+        # Return the numbers without repeats, and the arguments indexing
+        # into them.
+        numbers = []
+        indices = {}
+        arguments = array('I', self.arguments)
+        for i, opcode in enumerate(self.opcodes):
+            if opcode == NUMBER:
+                number = self.numbers[arguments[i]]
+                # 1 and 1.0, and 0.0 and -0.0, are equal but distinct.
+                key = (type(number), number, str(number))
+                if key not in indices:
+                    indices[key] = len(numbers)
+                    numbers.append(number)
+                arguments[i] = indices[key]
+        return numbers, arguments
+
+    def __reduce__(self):
+        return (RPNExpression.from_bytes, (self.to_bytes(),))
+
+    def evaluate(self, parser):
+        '''
+        Evaluates the expression with the functions, angle mode and variables
+        of the given parser.
+        '''
+        opcodes, arguments, bindings = self._bind(parser)
+        numbers = self.numbers
+        scope = parser.variable_values
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        for opcode, argument in zip(opcodes, arguments):
+            if opcode == NUMBER:
+                push(numbers[argument])
+            elif opcode == ADD:
+                second = pop()
+                stack[-1] = stack[-1] + second
+            elif opcode == SUBTRACT:
+                second = pop()
+                stack[-1] = stack[-1] - second
+            elif opcode == MULTIPLY:
+                second = pop()
+                stack[-1] = stack[-1] * second
+            elif opcode == DIVIDE:
+                second = pop()
+                stack[-1] = stack[-1] / second
+            elif opcode == CONSTANT:
+                push(bindings[argument])
+            elif opcode == INFIX:
+                second = pop()
+                stack[-1] = bindings[argument](stack[-1], second)
+            elif opcode == NEGATE:
+                stack[-1] = -1*stack[-1]
+            elif opcode == VARIABLE:
+                try:
+                    push(scope[bindings[argument]])
+                except KeyError:
+                    raise ep.MathSyntaxError
+            else:
+                stack[-1] = bindings[argument](stack[-1])
+        return stack[-1]
+
+    def to_operation(self, parser):
+        '''
+        Converts back to an operation tree bound to the given parser.
+        '''
+        stack = []
+        for opcode, argument in zip(self.opcodes, self.arguments):
+            if opcode == NUMBER:
+                stack.append(ep.Operand(self.numbers[argument]))
+            elif opcode == CONSTANT:
+                name = self.names[argument]
+                stack.append(ep.Constant(name, parser.backend.constants[name]))
+            elif opcode == VARIABLE:
+                stack.append(ep.Variable(self.names[argument],
+                    parser.variable_values))
+            elif opcode == POSTFIX:
+                operator = parser.postfix_operators[self.names[argument]]
+                stack.append(ep.PostfixOperation(operator, stack.pop()))
+            elif opcode == FUNCTION or opcode == NEGATE:
+                if opcode == NEGATE:
+                    operation = ep.Function(parser.negation_operator)
+                else:
+                    operation = ep.Function(
+                        parser.function_operators[self.names[argument]])
+                operation.insert_operand(stack.pop())
+                stack.append(operation)
+            else:
+                if opcode == INFIX:
+                    symbol = self.names[argument]
+                else:
+                    symbol = _ARITHMETIC_SYMBOLS[opcode]
+                second_operand = stack.pop()
+                operation = ep.InfixOperation(parser.infix_operators[symbol],
+                    stack.pop())
+                operation.set_second_operand(second_operand)
+                stack.append(operation)
+        return stack.pop()
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def _bind(self, parser):
+        # Return the opcodes, arguments and bindings evaluated with the
+        # parser. They depend only on the parser's functions, which are
+        # replaced whenever its angle mode changes, and its operators.
+        if self.bindings and self.bindings[0] is parser.functions:
+            return self.bindings[1:]
+
+        opcodes = self.opcodes
+        arguments = self.arguments
+        bindings = [None] * len(self.names)
+        # The arithmetic opcodes compute the default operators inline, so
+        # those a backend replaces are called as INFIX operators instead.
+        replaced = {}
+        for i, (opcode, argument) in enumerate(zip(self.opcodes,
+            self.arguments)):
+            name = self.names[argument] if opcode in _NAMED_OPCODES else None
+            if opcode in _ARITHMETIC_SYMBOLS:
+                symbol = _ARITHMETIC_SYMBOLS[opcode]
+                function = parser.infix_operators[symbol].get_function()
+                if function is ep.Parser.INFIX_OPERATORS[symbol]['func']:
+                    continue
+                if symbol not in replaced:
+                    replaced[symbol] = len(bindings)
+                    bindings.append(function)
+                if opcodes is self.opcodes:
+                    opcodes = array('B', opcodes)
+                    arguments = array('I', arguments)
+                opcodes[i] = INFIX
+                arguments[i] = replaced[symbol]
+            elif opcode == CONSTANT:
+                bindings[argument] = parser.backend.constants[name]
+            elif opcode == VARIABLE:
+                bindings[argument] = name
+            elif opcode == INFIX:
+                bindings[argument] = parser.infix_operators[name].get_function()
+            elif opcode == POSTFIX:
+                bindings[argument] = parser.postfix_operators[name].get_function()
+            elif opcode == FUNCTION:
+                bindings[argument] = parser.functions[name]
+        self.bindings = (parser.functions, opcodes, arguments, bindings)
+        return opcodes, arguments, bindings
+
+
+_ARITHMETIC_SYMBOLS = {opcode: symbol for symbol, opcode in ARITHMETIC_OPCODES.items()}
+_NAMED_OPCODES = {CONSTANT, VARIABLE, INFIX, POSTFIX, FUNCTION}
+_OPERAND_OPCODES = {NUMBER, CONSTANT, VARIABLE}
+_UNARY_OPCODES = {POSTFIX, FUNCTION, NEGATE}
+
+
+def _check_program(opcodes, arguments, num_numbers, num_names):
+    # Checks that loaded opcodes and arguments form an expression: known
+    # opcodes whose indices are in their table and which leave exactly one
+    # value on the stack, so that a corrupt one is refused when it is loaded
+    # rather than failing when it is evaluated.
+    depth = 0
+    for opcode, argument in zip(opcodes, arguments):
+        if opcode > NEGATE:
+            raise ValueError('corrupt serialized expression')
+        if opcode == NUMBER:
+            in_range = argument < num_numbers
+        elif opcode in _NAMED_OPCODES:
+            in_range = argument < num_names
+        else:
+            in_range = True
+        if opcode in _OPERAND_OPCODES:
+            depth += 1
+        elif opcode in _UNARY_OPCODES:
+            in_range = in_range and depth >= 1
+        else:
+            in_range = in_range and depth >= 2
+            depth -= 1
+        if not in_range:
+            raise ValueError('corrupt serialized expression')
+    if depth != 1:
+        raise ValueError('corrupt serialized expression')
+
+
+def dumps(operation):
+    '''
+    Serializes an operation tree returned by Parser.parse.
+    '''
+    return RPNExpression.from_operation(operation).to_bytes()
+
+
+def loads(data, parser):
+    '''
+    Restores an operation tree serialized by dumps, binding its operators
+    and functions to the given parser by symbol.
+    '''
+    return RPNExpression.from_bytes(data, parser.make_float).to_operation(parser)
+
+
+def _pack_number(number):
+    if isinstance(number, float):
+        return bytes((_FLOAT,)) + _DOUBLE.pack(number)
+    elif isinstance(number, int):
+        if -1 << 31 <= number < 1 << 31:
+            return bytes((_INT,)) + _INT32.pack(number)
+        encoded = number.to_bytes((number.bit_length() + 8) // 8, 'little',
+            signed=True)
+        tag = _BIG_INT
+    else:
+        # Numbers of other backends, such as mpmath, are stored as their
+        # decimal text.
+        encoded = str(number).encode('utf-8')
+        tag = _TEXT
+    return bytes((tag,)) + _LENGTH.pack(len(encoded)) + encoded
+
+
+def _padded(size):
+    return (size + 3) & ~3
@@ -0,0 +1,59 @@
+# Measures how long the calculator takes to become interactive, split into
+# phases such as importing modules, building widgets and showing the first
+# frame. The report is printed to stderr when the CALCULATOR_PROFILE_STARTUP
+# environment variable is set or main.py is run with --profile-startup.
+#
+# This module is imported first so that its import time marks the start.
+import os
+import sys
+import time
+
+ENVIRONMENT_VARIABLE = 'CALCULATOR_PROFILE_STARTUP'
+FLAG = '--profile-startup'
+
+_start_time = time.perf_counter()
+
+class StartupProfile:
+    def __init__(self, enabled, start_time=None):
+        '''
+        Initializes a StartupProfile object.
+
+        enabled: whether report prints anything
+        start_time: the perf_counter value at which the first phase
+            started. Defaults to the time this module was imported.
+        '''
+        self.enabled = enabled
+        self.start_time = _start_time if start_time is None else start_time
+        self.last_time = self.start_time
+        self.phases = []
+
+    def get_phases(self):
+        '''
+        Return a list of (phase, seconds) tuples in the order they were
+        marked.
+        '''
+        return self.phases
+
+    def is_enabled(self):
+        return self.enabled
+
+    def mark(self, phase):
+        '''
+        Record the end of a phase, which started when the previous one ended.
+        '''
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last_time))
+        self.last_time = now
+
+    def report(self, file=None):
+        if not self.enabled:
+            return
+        file = file or sys.stderr
+        for phase, seconds in self.phases:
+            print('%-28s %8.1f ms' % (phase, seconds * 1000), file=file)
+        print('%-28s %8.1f ms' % ('total', (self.last_time - self.start_time) * 1000),
+            file=file)
+
+
+profile = StartupProfile(bool(os.environ.get(ENVIRONMENT_VARIABLE)) or
+    FLAG in sys.argv)
@@ -0,0 +1,132 @@
+# Checks that operation trees give the same results and strings whether they
+# are evaluated and written with recursion or with the explicit stack used
+# for deep trees.
+# Run with python -m unittest.
+import math
+import random
+import unittest
+import expressioninterner as ei
+import expressionparser as ep
+
+ATOMS = ['1', '0', '2.5', 'x', 'pi', '(1/0)', 'sqrt(-1)', 'ln(0)', '']
+
+def make_expression(rng, depth):
+    '''
+    Return a random expression nested up to depth levels, which may be
+    invalid or fail to evaluate.
+    '''
+    if depth == 0 or rng.random() < 0.3:
+        return rng.choice(ATOMS)
+    kind = rng.random()
+    if kind < 0.5:
+        return make_expression(rng, depth - 1) + rng.choice('+-*/^') + \
+            make_expression(rng, depth - 1)
+    elif kind < 0.6:
+        return '(' + make_expression(rng, depth - 1) + ')'
+    elif kind < 0.7:
+        return rng.choice(['sin', 'sqrt', 'ln', '-']) + '(' + \
+            make_expression(rng, depth - 1) + ')'
+    elif kind < 0.8:
+        return make_expression(rng, depth - 1) + rng.choice('+*()!')
+    return '-' + make_expression(rng, depth - 1)
+
+
+def get_outcome(operation):
+    # The value of an operation, or the type of the error it raises.
+    try:
+        value = operation.get_value()
+    except (ep.MathSyntaxError, AttributeError):
+        return 'syntax'
+    except Exception as error:
+        return type(error).__name__
+    if isinstance(value, float) and math.isnan(value):
+        return 'nan'
+    return repr(value)
+
+
+class RecursionDepthTest(unittest.TestCase):
+    DEPTHS = (0, 1, 2)
+
+    def setUp(self):
+        self.max_depth = ep.Operation.MAX_RECURSION_DEPTH
+
+    def tearDown(self):
+        ep.Operation.MAX_RECURSION_DEPTH = self.max_depth
+
+    def evaluate(self, expression, depth, x):
+        # Parses a new tree, so that no value is cached, and evaluates it
+        # twice to also compare the cached values.
+        ep.Operation.MAX_RECURSION_DEPTH = depth
+        parser = ep.Parser(variables=('x',))
+        if x is not None:
+            parser.set_variable('x', x)
+        try:
+            operation = parser.parse(expression)
+        except (ep.MathSyntaxError, ep.UnexpectedOperandError, ValueError,
+            AttributeError):
+                return None
+        if not isinstance(operation, ep.Operation):
+            return None
+        return [get_outcome(operation), get_outcome(operation)]
+
+    def write(self, expression, depth):
+        # Parses a new tree, so that no string is cached, and writes it.
+        ep.Operation.MAX_RECURSION_DEPTH = depth
+        try:
+            operation = ep.Parser(variables=('x',)).parse(expression)
+        except (ep.MathSyntaxError, ep.UnexpectedOperandError, ValueError,
+            AttributeError):
+                return None
+        if operation is None:
+            return None
+        return [str(operation), operation.get_unicode_string()]
+
+    def test_values_and_errors(self):
+        rng = random.Random(7)
+        for i in range(2000):
+            expression = make_expression(rng, 4)
+            x = rng.choice([None, 1.5])
+            expected = self.evaluate(expression, self.max_depth, x)
+            for depth in RecursionDepthTest.DEPTHS:
+                self.assertEqual(self.evaluate(expression, depth, x), expected,
+                    '%r at depth %d' % (expression, depth))
+
+    def test_strings(self):
+        rng = random.Random(11)
+        for i in range(2000):
+            expression = make_expression(rng, 4)
+            expected = self.write(expression, self.max_depth)
+            for depth in RecursionDepthTest.DEPTHS:
+                self.assertEqual(self.write(expression, depth), expected,
+                    '%r at depth %d' % (expression, depth))
+
+    def test_shared_operation_computed_once(self):
+        for depth in (self.max_depth,) + RecursionDepthTest.DEPTHS:
+            ep.Operation.MAX_RECURSION_DEPTH = depth
+            parser = ep.Parser(variables=('x',))
+            parser.set_variable('x', 0.5)
+            operation = ei.Interner().intern(
+                parser.parse('sin(x)^2+sin(x)*cos(x)+sin(x)'))
+            calls = []
+            sine = parser.function_operators['sin']
+            function = sine.function
+            sine.function = lambda a: calls.append(a) or function(a)
+            try:
+                value = operation.get_value()
+                parser.set_variable('x', 1.0)
+                operation.get_value()
+            finally:
+                sine.function = function
+            self.assertEqual(len(calls), 2)
+            sin_x = math.sin(0.5)
+            self.assertAlmostEqual(value,
+                sin_x ** 2 + sin_x * math.cos(0.5) + sin_x)
+
+    def test_deep_tree(self):
+        operation = ep.Parser().parse('(' * 20000 + '1' + '+1)' * 20000)
+        self.assertEqual(operation.get_value(), 20001)
+        self.assertEqual(str(operation), '1' + '+1' * 20000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,21 +1,47 @@
 # Adds functionality for angle unit selection between degrees and radians.
-import math
+import mathbackends as mb
 
 class TrigConfigurator:
-    def __init__(self, use_degrees=False):
+    # Incremented whenever any configurator changes mode, so that cached
+    # values computed in the old mode can be recognized as stale.
+    generation = 0
+
+    def __init__(self, use_degrees=False, backend=None):
+        '''
+        Initializes a TrigConfigurator object.
+
+        use_degrees: whether angles are in degrees rather than radians
+        backend: the MathBackend implementing the functions. Defaults to
+            the math module.
+        '''
         self.use_degrees = use_degrees
+        self.backend = backend or mb.MATH_BACKEND
+
+    def make_function(self, name):
+        '''
+        Return the function registered in mathbackends as name. Functions
+        taking or returning an angle use the angle unit of this
+        configurator, including after set_mode.
+        '''
+        function = self.backend.get_function(name)
+        kind = mb.get_function_kind(name)
+        if kind == mb.PLAIN:
+            return function
+        return AngleFunction(self, function, kind)
 
     def set_mode(self, use_degrees):
+        if use_degrees != self.use_degrees:
+            TrigConfigurator.generation += 1
         self.use_degrees = use_degrees
-    
+
     def sin(self, num):
-        return self._choose_funct(math.sin, num)
+        return self._choose_funct(self.backend.get_function('sin'), num)
 
     def cos(self, num):
-        return self._choose_funct(math.cos, num)
+        return self._choose_funct(self.backend.get_function('cos'), num)
 
     def tan(self, num):
-        return self._choose_funct(math.tan, num)
+        return self._choose_funct(self.backend.get_function('tan'), num)
 
     def _choose_funct(self, funct, num):
         if self.use_degrees:
@@ -24,4 +50,27 @@ class TrigConfigurator:
             return funct(num)
 
     def _in_degrees(self, funct, num):
-        return funct(math.radians(num))
\ No newline at end of file
+        return funct(self.backend.radians(num))
+
+
+class AngleFunction:
+    '''
+    A function of the backend whose argument (ANGLE_ARGUMENT) or result
+    (ANGLE_RESULT) is an angle in radians, converted to or from the angle
+    unit of a TrigConfigurator.
+    '''
+    __slots__ = ('config', 'function', 'kind')
+
+    def __init__(self, config, function, kind):
+        self.config = config
+        self.function = function
+        self.kind = kind
+
+    def __call__(self, num):
+        config = self.config
+        if not config.use_degrees:
+            return self.function(num)
+        elif self.kind == mb.ANGLE_ARGUMENT:
+            return self.function(config.backend.radians(num))
+        else:
+            return config.backend.degrees(self.function(num))
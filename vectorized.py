@@ -0,0 +1,112 @@
+# Evaluates parsed expressions over NumPy arrays in a single vectorized pass,
+# for running the same formula over many inputs without the GUI.
+import math
+import numpy as np
+import expressionparser as ep
+import mathbackends as mb
+
+# Factorials which fit in a float, followed by inf for everything larger.
+_FACTORIALS = np.array([math.factorial(n) for n in range(171)] + [math.inf],
+    dtype=float)
+
+def factorial(values):
+    '''
+    Vectorized factorial. Elements which are not non-negative integers give
+    nan, elements whose factorial overflows a float give inf.
+    '''
+    values = np.asarray(values, dtype=float)
+    valid = (values >= 0) & (values == np.floor(values))
+    indices = np.where(valid, np.minimum(values, 171), 0).astype(np.intp)
+    return np.where(valid, _FACTORIALS[indices], np.nan)
+
+
+class VectorEvaluator:
+    INFIX_FUNCTIONS = {
+        '+': np.add,
+        '-': np.subtract,
+        '*': np.multiply,
+        '/': np.true_divide,
+        '^': np.float_power
+    }
+    POSTFIX_FUNCTIONS = {
+        '!': factorial
+    }
+    FUNCTIONS = {
+        '-': np.negative
+    }
+
+    def __init__(self, trig_config):
+        '''
+        Initializes a VectorEvaluator object. Named functions are taken from
+        the NumPy backend of mathbackends.
+
+        trig_config: the TrigConfigurator of the Parser which produced the
+            operations. Its angle mode is read on every evaluation.
+        '''
+        self.trig_config = trig_config
+        self.backend = mb.get_backend('numpy')
+
+    def evaluate(self, operation, **variables):
+        '''
+        Evaluates an operation tree for every element of the given arrays.
+
+        Division by zero and invalid arguments give inf or nan in the
+        affected elements instead of raising, so one bad input does not abort
+        the whole batch.
+
+        operation: the Operand returned by Parser.parse
+        variables: arrays (or scalars) for each free variable of the
+            expression. They are broadcast against each other.
+
+        return: a NumPy array of results
+        '''
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            return np.asarray(self._evaluate(operation, variables))
+
+    def _evaluate(self, operation, variables):
+        # The arrays of operations are kept by identity, so the operations
+        # shared in an interned tree are computed once.
+        results = []
+        computed = {}
+
+        def is_computed(operation):
+            return id(operation) in computed
+
+        for node in ep.walk_post_order(operation, is_computed):
+            if node is None:
+                raise ep.MathSyntaxError
+            elif id(node) in computed:
+                results.append(computed[id(node)])
+            elif isinstance(node, ep.InfixOperation):
+                second = results.pop()
+                first = results.pop()
+                function = self.INFIX_FUNCTIONS[node.operator.symbol]
+                computed[id(node)] = function(first, second)
+                results.append(computed[id(node)])
+            elif isinstance(node, ep.PostfixOperation):
+                computed[id(node)] = self._apply(node, results.pop())
+                results.append(computed[id(node)])
+            elif isinstance(node, ep.Variable):
+                try:
+                    results.append(np.asarray(variables[node.key]))
+                except KeyError:
+                    raise ep.MathSyntaxError
+            else:
+                results.append(node.get_value())
+        return results.pop()
+
+    def _apply(self, operation, values):
+        symbol = operation.operator.symbol
+        if not isinstance(operation, ep.Function):
+            return self.POSTFIX_FUNCTIONS[symbol](values)
+        if symbol in self.FUNCTIONS:
+            return self.FUNCTIONS[symbol](values)
+        function = self.backend.get_module_function(symbol)
+        if not self.trig_config.use_degrees:
+            return function(values)
+        kind = mb.get_function_kind(symbol)
+        if kind == mb.ANGLE_ARGUMENT:
+            return function(np.radians(values))
+        elif kind == mb.ANGLE_RESULT:
+            return np.degrees(function(values))
+        return function(values)
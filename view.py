@@ -6,19 +6,56 @@ from display import InputLine, HistoryDisplay
 
 
 class View(ttk.Frame):
-    def __init__(self):
+    HISTORY_ROWS = 4
+
+    def __init__(self, lazy=False, history_size=None):
+        '''
+        Initializes a View object.
+
+        lazy: whether to show the window with only the input line and the
+            number and operator buttons, and build the trigonometric
+            buttons, the angle unit selector and the history once the first
+            frame has been drawn. Until then, calls which concern these
+            widgets are remembered and applied when they are built.
+        history_size: the number of history entries which can be scrolled
+            through, or None to keep every entry
+        '''
         ttk.Frame.__init__(self)
         self.input_string = ttk.tkinter.StringVar()
         self.output_string = ttk.tkinter.StringVar()
-        self.angle_unit_selector = sp.SelectorPanel(self, sp.Layout.DEG_RAD.value) #TODO move layouts from enum to dict
         self.button_frame = ttk.Frame(self)
         self.number_panel = ButtonPanel(self.button_frame, Layouts.NUM)
         self.operator_panel = ButtonPanel(self.button_frame, Layouts.OPER)
-        self.trig_panel = ButtonPanel(self.button_frame, Layouts.TRIG)
         self.input_line = InputLine(self)
-        self.history_display = HistoryDisplay(self, self.set_input_display)
+        self.angle_unit_selector = None
+        self.trig_panel = None
+        self.history_display = None
+        self.history_size = history_size
+        self.plot_view = None
+        self.button_function = None
+        self.angle_mode_observer = None
+        self.history_loader = None
+        self.pending_history_updates = []
+        self.build_observers = []
         self.show()
-    
+
+        if lazy:
+            # Waiting for a timer scheduled from an idle callback lets tkinter
+            # draw the first frame, which it also does when idle.
+            self.after_idle(self.after, 0, self._build_deferred_widgets)
+        else:
+            self._build_deferred_widgets()
+
+    def add_build_observer(self, callback):
+        '''
+        Call callback once every widget has been built, or immediately if
+        they already have been.
+        '''
+        if self.history_display:
+            callback()
+        else:
+            self.build_observers.append(callback)
+
     def append_to_input(self, string):
         self.input_line.append_to_input(string)
 
@@ -26,27 +63,49 @@ class View(ttk.Frame):
         self.input_line.backspace()
 
     def bind_all_buttons(self, function):
+        self.button_function = function
         self.number_panel.bind_all_buttons(function)
         self.operator_panel.bind_all_buttons(function)
-        self.trig_panel.bind_all_buttons(function)
+        if self.trig_panel:
+            self.trig_panel.bind_all_buttons(function)
 
     def clear_input(self):
         self.input_line.clear_input()
 
     def get_angle_mode(self):
-        return self.angle_unit_selector.get_mode()
+        if self.angle_unit_selector:
+            return self.angle_unit_selector.get_mode()
+        # The selector starts with its first button selected.
+        return sp.Layout.DEG_RAD.value[0][0][1]
 
     def get_input(self):
         return self.input_line.get_input()
 
+    def hide_plot(self):
+        if self.plot_view:
+            self.plot_view.clear()
+            self.plot_view.pack_forget()
+
+    def push_history_entry(self, input_string, result_string):
+        self._update_history(HistoryDisplay.push_entry, input_string,
+            result_string)
+
     def set_angle_mode_observer(self, callback):
-        return self.angle_unit_selector.set_mode_observer(callback)
-    
+        self.angle_mode_observer = callback
+        if self.angle_unit_selector:
+            self.angle_unit_selector.set_mode_observer(callback)
+
     def set_current_result(self, string):
         self.input_line.set_result(string)
 
-    def set_history_entry(self, row, input_string, result_string):
-        self.history_display.set_entry(row, input_string, result_string)
+    def set_history_loader(self, loader):
+        '''
+        Set the function loading older history entries as they are scrolled
+        to, as taken by HistoryDisplay.set_loader.
+        '''
+        self.history_loader = loader
+        if self.history_display:
+            self.history_display.set_loader(loader)
 
     def set_input_display(self, text):
         self.input_line.clear_input()
@@ -55,16 +114,62 @@ class View(ttk.Frame):
     def set_input_observer(self, callback):
         self.input_line.set_input_observer(callback)
 
+    def show_plot(self, operation, trig_config):
+        '''
+        Show the plot of an operation tree against its free variable above
+        the input line, or an empty plot if operation is None.
+
+        trig_config: the TrigConfigurator of the Parser of the operation
+        '''
+        if not self.plot_view:
+            # Plotting requires NumPy, which is only imported once a plot is
+            # first shown.
+            import plotview
+            self.plot_view = plotview.PlotView(self)
+        if not self.plot_view.winfo_manager():
+            self.plot_view.pack(before=self.input_line, expand=True,
+                side='top', fill='both')
+        self.plot_view.plot(operation, trig_config)
+
     def show_button_frame(self):
-        self.trig_panel.grid(row=0)
         self.number_panel.grid(row=0, column=1, rowspan=5, columnspan=3)
         self.operator_panel.grid(row=0, column=4, rowspan=5)
 
         self.button_frame.pack()
-    
+
     def show(self):
         self.grid()
-        self.history_display.pack(expand=True, side='top', fill='x')
         self.input_line.pack(expand=True, side='top', fill='x')
-        self.angle_unit_selector.pack(expand=True, side='top', fill='x')
-        self.show_button_frame()
\ No newline at end of file
+        self.show_button_frame()
+
+    def _build_deferred_widgets(self):
+        self.trig_panel = ButtonPanel(self.button_frame, Layouts.TRIG)
+        self.trig_panel.grid(row=0)
+        if self.button_function:
+            self.trig_panel.bind_all_buttons(self.button_function)
+
+        self.angle_unit_selector = sp.SelectorPanel(self, sp.Layout.DEG_RAD.value) #TODO move layouts from enum to dict
+        self.angle_unit_selector.pack(before=self.button_frame, expand=True,
+            side='top', fill='x')
+        if self.angle_mode_observer:
+            self.angle_unit_selector.set_mode_observer(self.angle_mode_observer)
+
+        self.history_display = HistoryDisplay(self, self.set_input_display,
+            View.HISTORY_ROWS, self.history_size)
+        if self.history_loader:
+            self.history_display.set_loader(self.history_loader)
+        self.history_display.pack(before=self.input_line, expand=True,
+            side='top', fill='x')
+        for function, args in self.pending_history_updates:
+            function(self.history_display, *args)
+        self.pending_history_updates = []
+
+        for callback in self.build_observers:
+            callback()
+        self.build_observers = []
+
+    def _update_history(self, function, *args):
+        if self.history_display:
+            function(self.history_display, *args)
+        else:
+            self.pending_history_updates.append((function, args))